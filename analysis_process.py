@@ -0,0 +1,267 @@
+# 化学笺集自动化滴定项目的一部分，用于在线程池或工作进程中进行逐帧颜色分析
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import time
+import argparse
+import threading
+import itertools
+import collections
+import multiprocessing
+import weakref
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import Future, ThreadPoolExecutor
+import cap_process
+import titration
+
+class ThreadAnalysisPool:
+    # 在共享的有界线程池中分析，OpenCV/numpy计算期间释放GIL
+
+    def __init__(self,workers=None):
+        self.executor=ThreadPoolExecutor(max_workers=workers,thread_name_prefix='analysis')
+
+    def analyze(self,proc):
+        return self.executor.submit(proc.analyze).result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+class FrameRing:
+    # 共享内存中的帧环形缓冲区，主进程写入后只需向工作进程传递槽位号，不序列化像素数据
+
+    def __init__(self,shape,slots=2,name=None):
+        self.shape=tuple(shape)
+        self.slots=slots
+        self.frame_bytes=int(np.prod(self.shape))
+        if name is None:
+            self.shm=shared_memory.SharedMemory(create=True,size=self.frame_bytes*slots)
+            self.owner=True
+        else:
+            self.shm=shared_memory.SharedMemory(name=name)
+            self.owner=False
+        self.name=self.shm.name
+        self.buffer=np.ndarray((slots,)+self.shape,dtype=np.uint8,buffer=self.shm.buf)
+        self.next_slot=0
+
+    def write(self,frame):
+        slot=self.next_slot
+        np.copyto(self.buffer[slot],frame)
+        self.next_slot=(slot+1)%self.slots
+        return slot
+
+    def frame(self,slot):
+        return self.buffer[slot]
+
+    def release(self):
+        self.buffer=None
+        try:
+            self.shm.close()
+            if self.owner:
+                self.shm.unlink()
+        except Exception:
+            pass
+
+def _run_worker(tasks,results,max_rings=32):
+    # 工作进程：按名称连接各工位的共享缓冲区，每个缓冲区对应一个独立的HSVProcessor
+    rings=collections.OrderedDict() # 名称 -> (FrameRing, HSVProcessor)
+    while True:
+        task=tasks.get()
+        if task is None:
+            break
+        task_id,name,shape,slot,roi,usemask,lower,upper,zone_grid,white_roi,white_reference,lab=task
+        try:
+            if name not in rings:
+                rings[name]=(FrameRing(shape,name=name),cap_process.HSVProcessor())
+                if len(rings)>max_rings:
+                    # 长期未使用的缓冲区（工位已重连或关闭）
+                    old_ring,_=rings.popitem(last=False)[1]
+                    old_ring.release()
+            rings.move_to_end(name)
+            ring,proc=rings[name]
+            proc.sample_roi=tuple(roi)
+            proc.usemask=usemask
+            proc.hsv_lower=np.array(lower)
+            proc.hsv_upper=np.array(upper)
+            proc.zone_grid=tuple(zone_grid)
+            proc.white_roi=white_roi
+            proc.white_reference=None if white_reference is None else np.array(white_reference)
+            proc.lab=lab
+            proc.frame=ring.frame(slot)
+            zone_mean,zone_median,zone_std=proc.get_zone_stats()
+            results.put((task_id,zone_mean,zone_median,zone_std,proc.zone_count,proc.zone_lab,None))
+        except Exception as e:
+            results.put((task_id,None,None,None,None,None,f'{e}'))
+    for ring,_ in rings.values():
+        ring.release()
+
+class ProcessAnalysisPool:
+    # 采集与泵控制留在主进程，分析交给工作进程；结果为各区域的小数组，经队列返回
+
+    def __init__(self,workers=None,slots=2,timeout=5.0):
+        ctx=multiprocessing.get_context('spawn')
+        self.slots=slots
+        self.timeout=timeout
+        self.tasks=ctx.Queue()
+        self.results=ctx.Queue()
+        self.workers=[ctx.Process(target=_run_worker,args=(self.tasks,self.results),daemon=True)
+                      for _ in range(workers or multiprocessing.cpu_count())]
+        for worker in self.workers:
+            worker.start()
+        self.rings=weakref.WeakKeyDictionary() # HSVProcessor -> FrameRing
+        self.pending={} # 任务号 -> Future
+        self.lock=threading.Lock()
+        self.task_ids=itertools.count()
+        self._result_thread=threading.Thread(target=self._run_results)
+        self._result_thread.daemon=True
+        self._result_thread.start()
+
+    def _run_results(self):
+        while True:
+            result=self.results.get()
+            if result is None:
+                break
+            with self.lock:
+                future=self.pending.pop(result[0],None)
+            if future is not None:
+                future.set_result(result[1:])
+
+    def _ring_for(self,proc):
+        frame=proc.frame
+        with self.lock:
+            ring=self.rings.get(proc)
+            if ring is None or ring.shape!=frame.shape:
+                if ring is not None:
+                    ring.release()
+                ring=FrameRing(frame.shape,self.slots)
+                self.rings[proc]=ring
+                # 处理器被回收（如重新连接硬件）时释放共享内存
+                weakref.finalize(proc,ring.release)
+            return ring
+
+    def analyze(self,proc):
+        ring=self._ring_for(proc)
+        slot=ring.write(proc.frame)
+        task_id=next(self.task_ids)
+        future=Future()
+        with self.lock:
+            self.pending[task_id]=future
+        self.tasks.put((task_id,ring.name,ring.shape,slot,tuple(proc.sample_roi),proc.usemask,
+                        tuple(int(v) for v in proc.hsv_lower),tuple(int(v) for v in proc.hsv_upper),
+                        tuple(proc.zone_grid),proc.white_roi,
+                        None if proc.white_reference is None else tuple(proc.white_reference),proc.lab))
+        try:
+            zone_mean,zone_median,zone_std,zone_count,zone_lab,error=future.result(self.timeout)
+        finally:
+            with self.lock:
+                self.pending.pop(task_id,None)
+        if error is not None:
+            raise Exception(f'AnalysisWorkerError: {error}')
+
+        x, y, zone_w, zone_h = proc.zone_geometry()
+        analysis=cap_process.FrameAnalysis(proc.frame_seq,proc.frame_ts)
+        analysis.zone_mean=zone_mean
+        analysis.zone_median=zone_median
+        analysis.zone_std=zone_std
+        analysis.zone_count=zone_count
+        analysis.zone_lab=zone_lab
+        analysis.coverage=zone_count/max(zone_w*zone_h,1)
+        analysis.analyzed_at=time.monotonic()
+        proc.set_analysis(analysis)
+        return analysis
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2)
+        self.results.put(None)
+        with self.lock:
+            for ring in self.rings.values():
+                ring.release()
+
+def create_analysis_pool(mode='thread',workers=None):
+    # mode: thread 共享线程池；process 工作进程+共享内存
+    if mode=='process':
+        return ProcessAnalysisPool(workers)
+    if mode=='thread':
+        return ThreadAnalysisPool(workers)
+    raise Exception('UnknownAnalysisMode')
+
+def _bench_frames(size,count=8):
+    # 合成测试帧：随机纹理叠加逐帧变化的底色
+    w,h=size
+    rng=np.random.default_rng(0)
+    frames=[]
+    for i in range(count):
+        frame=rng.integers(0,40,(h,w,3),dtype=np.uint8)
+        frame+=np.array([120,60+i*10,30],dtype=np.uint8)
+        frames.append(frame)
+    return frames
+
+def _bench_station(pool,frames,roi,zone_grid,duration,counts,index,start):
+    proc=cap_process.HSVProcessor()
+    proc.sample_roi=roi
+    proc.zone_grid=tuple(zone_grid)
+    proc.set_frame(frames[0],0,0.0)
+    cd=titration.ColorDetect(30,1.5)
+    cd.proc=proc
+    cd.reference_zones,_,_=proc.get_zone_stats()
+    cd._build_thresholds()
+    cd.initialized=True
+    start.wait()
+    end=time.perf_counter()+duration
+    seq=0
+    while time.perf_counter()<end:
+        seq+=1
+        # 采集线程给出的帧均为独立副本
+        proc.set_frame(frames[seq%len(frames)].copy(),seq,seq/30)
+        if pool is not None:
+            pool.analyze(proc)
+        cd.is_color_changed()
+        cd.is_color_homo()
+    counts[index]=seq
+
+def benchmark(stations,mode='thread',workers=None,size=(640,480),roi=None,zone_grid=(1,3),duration=3.0):
+    # 各工位在独立线程中循环分析，返回每个工位的帧率
+    frames=_bench_frames(size)
+    roi=roi or (size[0]//4,size[1]//4,size[0]//2,size[1]//2)
+    pool=None if mode=='inline' else create_analysis_pool(mode,workers)
+    try:
+        if pool is not None:
+            # 预热，工作进程启动及首次连接共享内存不计入
+            warm=cap_process.HSVProcessor()
+            warm.sample_roi=roi
+            warm.set_frame(frames[0],0,0.0)
+            pool.analyze(warm)
+        counts=[0]*stations
+        start=threading.Event()
+        threads=[threading.Thread(target=_bench_station,args=(pool,frames,roi,zone_grid,duration,counts,i,start))
+                 for i in range(stations)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return [count/duration for count in counts]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='多工位逐帧分析性能测试')
+    parser.add_argument('--stations', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--mode', nargs='+', default=['inline', 'thread', 'process'], choices=['inline', 'thread', 'process'])
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--size', type=int, nargs=2, default=[640, 480], metavar=('W', 'H'))
+    parser.add_argument('--roi', type=int, nargs=4, metavar=('X', 'Y', 'W', 'H'))
+    parser.add_argument('--zone-grid', type=int, nargs=2, default=[1, 3], metavar=('ROWS', 'COLS'))
+    parser.add_argument('--duration', type=float, default=3.0)
+    args=parser.parse_args()
+
+    print(f"{'mode':>8} {'stations':>8} {'fps/station':>12} {'min':>8} {'total':>8}")
+    for mode in args.mode:
+        for n in args.stations:
+            fps=benchmark(n, mode, args.workers, tuple(args.size), tuple(args.roi) if args.roi else None,
+                          args.zone_grid, args.duration)
+            print(f'{mode:>8} {n:>8} {np.mean(fps):>12.1f} {min(fps):>8.1f} {sum(fps):>8.1f}')
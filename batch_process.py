@@ -0,0 +1,171 @@
+# 化学笺集自动化滴定项目的一部分，用于批量滴定：按队列依次润洗、更换样品并滴定
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import time
+import threading
+
+class Job:
+    # 一个待滴定样品及其结果
+
+    def __init__(self,sample_id,exptype=None,rate=None,volume_limit=None):
+        self.sample_id=sample_id
+        self.exptype=exptype # 非空时滴定前由大模型预测终点颜色
+        self.rate=rate # 为空时使用当前配置的速度
+        self.volume_limit=volume_limit
+        self.status='queued' # queued rinsing refilling running done incomplete failed cancelled
+        self.volume=None # 终点体积，未到达终点时为空
+        self.time=None
+        self.started_at=None
+        self.finished_at=None
+        self.error=None
+
+    def to_dict(self):
+        return {'sample_id': self.sample_id, 'exptype': self.exptype, 'rate': self.rate,
+                'volume_limit': self.volume_limit, 'status': self.status, 'volume': self.volume,
+                'time': self.time, 'started_at': self.started_at, 'finished_at': self.finished_at,
+                'error': self.error}
+
+class BatchScheduler:
+    # 在同一个滴定实例上依次运行队列中的样品，摄像头与取样区域在样品之间保持不变，
+    # 各阶段均为可被停止唤醒的定时等待
+
+    def __init__(self,t):
+        self.t=t
+        self.jobs=[]
+        self.lock=threading.Lock()
+        self.cancel=threading.Event()
+        self.running=False
+        self.current=None
+        self._batch_thread=None
+
+    def add(self,sample_id,exptype=None,rate=None,volume_limit=None):
+        if rate is not None:
+            rate=f'{float(rate):05.2f}'
+        job=Job(sample_id,exptype,rate,volume_limit)
+        with self.lock:
+            self.jobs.append(job)
+        return job
+
+    def clear(self):
+        # 清除已结束的任务，保留排队中和进行中的任务
+        with self.lock:
+            self.jobs=[job for job in self.jobs if job.status=='queued' or job is self.current]
+
+    def _next_job(self):
+        with self.lock:
+            for job in self.jobs:
+                if job.status=='queued':
+                    return job
+        return None
+
+    def _run_job(self,job,first):
+        t=self.t
+        job.started_at=time.time()
+        self.t.mp.log('bj',f'{job.sample_id}')
+
+        if job.exptype:
+            t.llm_predict(job.exptype)
+
+        rinsed=False
+        if float(t.rinse_time)>0 and not self.cancel.is_set():
+            job.status='rinsing'
+            t.mp.log('ri')
+            t._run_rinse()
+            rinsed=True
+
+        # 润洗液流入了当前烧杯，第一个样品也需等待换上样品烧杯
+        if (rinsed or not first) and float(t.refill_time)>0 and not self.cancel.is_set():
+            # 等待更换烧杯、补充滴定液
+            job.status='refilling'
+            t.mp.log('rf',f'{t.refill_time} s')
+            self.cancel.wait(float(t.refill_time))
+
+        if self.cancel.is_set():
+            job.status='cancelled'
+            return
+
+        # 重新取参考颜色，取样区域沿用上一个样品；阈值与判定方式可能已由指示剂推荐参数更新
+        t.cd.reset(*t.detect_params())
+        rate,volume_limit=t.rate,t.volume_limit
+        try:
+            t.rate=job.rate or t.rate
+            t.volume_limit=job.volume_limit if job.volume_limit is not None else volume_limit
+            t.pump.setrate(t.rate)
+            job.status='running'
+            t.run()
+            thread=t._titration_thread
+            if thread is not None:
+                thread.join()
+        finally:
+            t.rate,t.volume_limit=rate,volume_limit
+            t.pump.setrate(t.rate)
+
+        if t.endpoint_volume is not None:
+            job.status='done'
+            job.volume=t.endpoint_volume
+            job.time=t.endpoint_time
+        else:
+            job.status='cancelled' if self.cancel.is_set() else 'incomplete'
+        t.mp.box('bd',f'{job.sample_id} {job.volume:.2f} mL' if job.volume is not None else f'{job.sample_id}')
+
+    def _run_batch(self):
+        t=self.t
+        t.mp.log('bs')
+        endpoint_alert=t.endpoint_alert
+        t.endpoint_alert=False # 无人值守时终点提示不阻塞队列
+        first=True
+        try:
+            while not self.cancel.is_set():
+                job=self._next_job()
+                if job is None:
+                    break
+                self.current=job
+                try:
+                    self._run_job(job,first)
+                except Exception as e:
+                    job.status='failed'
+                    job.error=f'{e}'
+                    t.mp.send('be',f'{job.sample_id} {e}')
+                job.finished_at=time.time()
+                first=False
+        finally:
+            t.endpoint_alert=endpoint_alert
+            # 批量结束后恢复配置的阈值与判定方式，下一次手动滴定重新取参考颜色
+            t.indicator=None
+            t.cd.reset(t.threshold,t.color_metric)
+            self.current=None
+            self.running=False
+            t.mp.log('bf')
+
+    def start(self):
+        if not self.running:
+            if self.t.cd is None or self.t.pump is None:
+                raise Exception('HardwareNotConnected')
+            self.cancel.clear()
+            self.running=True
+            self._batch_thread = threading.Thread(target=self._run_batch)
+            self._batch_thread.daemon = True
+            self._batch_thread.start()
+
+    def stop(self):
+        # 取消队列：中断当前阶段，当前样品标记为取消，其余样品保持排队
+        self.cancel.set()
+        self.t.stopped.set()
+        if self.t.running:
+            self.t.stop()
+
+    def progress(self):
+        with self.lock:
+            jobs=list(self.jobs)
+        finished=sum(job.status in ('done','incomplete','failed','cancelled') for job in jobs)
+        return {'running': self.running,
+                'current': self.current.sample_id if self.current else None,
+                'phase': self.current.status if self.current else None,
+                'finished': finished,
+                'total': len(jobs)}
+
+    def snapshot(self):
+        with self.lock:
+            jobs=[job.to_dict() for job in self.jobs]
+        return {**self.progress(),'jobs': jobs}
@@ -2,39 +2,316 @@
 # 作者：刘一弘，李峙德
 # 邮箱：contact@chemview.net
 # 最后更新：2025-10-18
+import os
 import cv2
+import glob
+import time
+import threading
+import warnings
+import collections
 import numpy as np
+import color_metric
 
 class Cap:
 
-    def __init__(self,cap_num):
+    # 默认采集规格：检测需要稳定、较高、低延迟的帧率，不需要全分辨率
+    # exposure、wb_temperature为空时先自动调节（曝光等待exposure_settle秒），再锁定为当前值，否则按给定值手动设置
+    default_profile={'width':640,'height':480,'fps':30,'fourcc':'MJPG','buffer_size':1,
+                     'exposure':None,'wb_temperature':None,'exposure_settle':1.0}
+
+    def __init__(self,cap_num,ring_size=4,profile=None):
         self.cap_num=cap_num
         self.cap=None
+        self.profile={**self.default_profile,**(profile or {})}
+        self.achieved={} # 驱动实际接受的参数
+        self.intervals=collections.deque(maxlen=120) # 最近的帧间隔，用于计算实际帧率与抖动
+        self.mp=None
         self.frame=None
+        self.ring_size=ring_size
+        self.ring=None # 预分配的帧缓冲环，由采集线程写入
+        self.ring_ts=[0.0]*ring_size
+        self.seq=0 # 最新完整帧的序号，0表示尚未采集到帧
+        self.timestamp=0.0
+        self.error=None
+        self._grabbing=False
+        self._grab_thread=None
+        self._new_frame=threading.Condition()
 
     def open_cap(self):
         self.cap = cv2.VideoCapture(int(self.cap_num))
-        self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1.0) # 打开自动曝光
-        self.cap.set(cv2.CAP_PROP_AUTO_WB, 1.0)
-        self.cap.set(cv2.CAP_PROP_AUTO_WB, 0.0)
 
         if not self.cap.isOpened():
             raise Exception('CapConnectionError')
 
+        self._negotiate()
+        self._start_grab()
+
+    def _apply_profile(self,profile):
+        # 格式须先于分辨率设置，部分驱动只在对应格式下提供高帧率模式
+        if profile.get('fourcc'):
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*profile['fourcc']))
+        if profile.get('width') and profile.get('height'):
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, int(profile['width']))
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, int(profile['height']))
+        if profile.get('fps'):
+            self.cap.set(cv2.CAP_PROP_FPS, float(profile['fps']))
+        if profile.get('buffer_size'):
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, int(profile['buffer_size']))
+
+    def _apply_exposure(self,profile):
+        if profile.get('exposure') is None:
+            # 打开自动曝光并持续取帧使其收敛，读回曝光值后切换为手动，锁定在该值
+            self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1.0)
+            deadline = time.monotonic() + float(profile.get('exposure_settle') or 0)
+            while time.monotonic() < deadline:
+                if not self.cap.grab():
+                    break
+            exposure = self.cap.get(cv2.CAP_PROP_EXPOSURE)
+            # 不支持读回曝光值的后端返回0，此时保持自动曝光
+            if exposure:
+                self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.25)
+                self.cap.set(cv2.CAP_PROP_EXPOSURE, exposure)
+        else:
+            self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, 0.25) # 手动曝光
+            self.cap.set(cv2.CAP_PROP_EXPOSURE, float(profile['exposure']))
+        if profile.get('wb_temperature') is None:
+            # 先开启自动白平衡再关闭，锁定为当前值
+            self.cap.set(cv2.CAP_PROP_AUTO_WB, 1.0)
+            self.cap.set(cv2.CAP_PROP_AUTO_WB, 0.0)
+        else:
+            self.cap.set(cv2.CAP_PROP_AUTO_WB, 0.0)
+            self.cap.set(cv2.CAP_PROP_WB_TEMPERATURE, float(profile['wb_temperature']))
+
+    def _read_profile(self):
+        # 读回驱动实际使用的参数，不支持的属性通常返回0
+        code=int(self.cap.get(cv2.CAP_PROP_FOURCC))
+        fourcc=''.join(chr((code>>(8*i))&0xFF) for i in range(4)) if code>0 else ''
+        return {'width':int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                'height':int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'fps':self.cap.get(cv2.CAP_PROP_FPS),
+                'fourcc':fourcc,
+                'buffer_size':int(self.cap.get(cv2.CAP_PROP_BUFFERSIZE)),
+                'exposure':self.cap.get(cv2.CAP_PROP_EXPOSURE),
+                'wb_temperature':self.cap.get(cv2.CAP_PROP_WB_TEMPERATURE)}
+
+    def _accepted(self,profile,achieved):
+        if profile.get('width') and profile.get('height'):
+            if (achieved['width'],achieved['height'])!=(int(profile['width']),int(profile['height'])):
+                return False
+        # 无法读回格式的后端视为接受
+        return not profile.get('fourcc') or not achieved['fourcc'] or achieved['fourcc']==profile['fourcc']
+
+    def _negotiate(self):
+        # 先尝试请求的规格，不被接受时改用YUYV格式，仍不接受则保留驱动给出的最接近模式并记录
+        candidates=[self.profile]
+        if self.profile.get('fourcc') and self.profile['fourcc']!='YUYV':
+            candidates.append({**self.profile,'fourcc':'YUYV'})
+        achieved={}
+        for profile in candidates:
+            self._apply_profile(profile)
+            achieved=self._read_profile()
+            if self._accepted(profile,achieved):
+                break
+        self._apply_exposure(self.profile)
+        self.achieved=self._read_profile()
+        if self.mp:
+            self.mp.log('cp',f'{self.achieved}')
+            if not self._accepted(self.profile,self.achieved):
+                self.mp.log('cm',f'{self.profile}')
+
+    def frame_stats(self):
+        # 实际帧率及帧间隔抖动（标准差），单位毫秒
+        intervals=np.array(self.intervals)
+        if len(intervals)<2:
+            return {}
+        mean=float(intervals.mean())
+        return {'fps':1/mean if mean>0 else 0.0,
+                'interval_ms':mean*1000,
+                'jitter_ms':float(intervals.std())*1000,
+                'max_interval_ms':float(intervals.max())*1000}
+
+    def report(self):
+        return {'requested':self.profile,'achieved':self.achieved,'measured':self.frame_stats()}
+
     def close_cap(self):
-        self.cap.release()
+        # 停止并等待采集线程后释放摄像头，仍在等待新帧的线程收到CapClosed
+        self._grabbing=False
+        if self._grab_thread and self._grab_thread is not threading.current_thread():
+            self._grab_thread.join(timeout=1)
+        self._grab_thread=None
+        if self.error is None:
+            self.error=Exception('CapClosed')
+        with self._new_frame:
+            self._new_frame.notify_all()
+        if self.cap:
+            self.cap.release()
+
+    def _start_grab(self):
+        self.error=None
+        self._grabbing=True
+        self._grab_thread = threading.Thread(target=self._run_grab)
+        self._grab_thread.daemon = True
+        self._grab_thread.start()
+
+    def _run_grab(self):
+        # 采集线程：持续读取摄像头，写入环形缓冲区，始终只保留最新的若干帧
+        seq=self.seq
+        last_ts=None
+        self.intervals.clear()
+        try:
+            while self._grabbing:
+                slot=(seq+1)%self.ring_size
+                if self.ring is None:
+                    ret,frame = self.cap.read()
+                else:
+                    ret,frame = self.cap.read(self.ring[slot])
+                if not ret:
+                    raise Exception('CapReadError')
+
+                ts=time.monotonic()
+                if last_ts is not None:
+                    self.intervals.append(ts-last_ts)
+                last_ts=ts
+                if self.ring is None or frame.shape!=self.ring.shape[1:]:
+                    # 首帧或分辨率变化时重新分配缓冲区
+                    self.ring=np.empty((self.ring_size,)+frame.shape,dtype=frame.dtype)
+                    self.ring[slot]=frame
+                elif frame.ctypes.data!=self.ring[slot].ctypes.data:
+                    self.ring[slot]=frame
+
+                # 先写入数据与时间戳，最后发布序号
+                seq+=1
+                self.ring_ts[slot]=ts
+                self.seq=seq
+                with self._new_frame:
+                    self._new_frame.notify_all()
+        except Exception as e:
+            self.error=e
+            with self._new_frame:
+                self._new_frame.notify_all()
+
+    def latest(self):
+        # 无阻塞地获取最新帧，返回(序号, 时间戳, 帧)，尚无帧时帧为None
+        while True:
+            seq=self.seq
+            if seq==0:
+                return 0,0.0,None
+            slot=seq%self.ring_size
+            frame=self.ring[slot].copy()
+            ts=self.ring_ts[slot]
+            # 复制期间该槽位未被覆盖才视为有效
+            if self.seq-seq<self.ring_size-1:
+                return seq,ts,frame
+
+    def wait_frame(self,last_seq=0,timeout=3.0):
+        # 等待序号大于last_seq的新帧，超时或采集线程出错时抛出异常
+        if not self.cap:
+            self.open_cap()
+
+        deadline=time.monotonic()+timeout
+        with self._new_frame:
+            while self.seq<=last_seq and self.error is None:
+                remaining=deadline-time.monotonic()
+                if remaining<=0:
+                    raise Exception('CapReadError')
+                self._new_frame.wait(remaining)
+        if self.error is not None:
+            raise self.error
+
+        seq,ts,frame=self.latest()
+        self.timestamp=ts
+        self.frame=frame
+        return seq,ts,frame
 
     def get_frame(self):
-        if not self.cap:
+        # 返回最新帧，仅在尚未采集到任何帧时阻塞
+        seq,ts,frame=self.wait_frame(0)
+        return frame
+
+class VideoCap:
+    # 与Cap接口一致的离线帧源，从视频文件或图片序列逐帧读取，不限速，时间戳按帧率推算
+
+    image_exts=('.png','.jpg','.jpeg','.bmp','.tif','.tiff')
+
+    def __init__(self,path,fps=None):
+        self.path=path
+        self.fps=fps
+        self.cap=None
+        self.files=None
+        self.frame=None
+        self.seq=0
+        self.timestamp=0.0
+
+    def open_cap(self):
+        if os.path.isdir(self.path):
+            self.files=sorted(os.path.join(self.path,f) for f in os.listdir(self.path)
+                              if f.lower().endswith(self.image_exts))
+        elif glob.has_magic(self.path):
+            self.files=sorted(glob.glob(self.path))
+        else:
+            self.cap=cv2.VideoCapture(self.path)
+            if not self.cap.isOpened():
+                raise Exception('CapConnectionError')
+            if not self.fps:
+                self.fps=self.cap.get(cv2.CAP_PROP_FPS)
+
+        if self.files is not None and not self.files:
+            raise Exception('CapConnectionError')
+        if not self.fps:
+            self.fps=30.0
+
+    def close_cap(self):
+        if self.cap:
+            self.cap.release()
+
+    def _read(self):
+        if self.files is not None:
+            if self.seq>=len(self.files):
+                return None
+            return cv2.imread(self.files[self.seq])
+        ret,frame=self.cap.read()
+        return frame if ret else None
+
+    def wait_frame(self,last_seq=0,timeout=None):
+        # 每次调用读取下一帧，读完时抛出CapEndOfStream
+        if self.cap is None and self.files is None:
             self.open_cap()
 
-        ret,frame = self.cap.read()
-        if not ret:
-            raise Exception('CapReadError')
+        frame=self._read()
+        if frame is None:
+            raise Exception('CapEndOfStream')
 
+        self.timestamp=self.seq/self.fps
+        self.seq+=1
         self.frame=frame
+        return self.seq,self.timestamp,frame
 
-        return frame
+    def latest(self):
+        return self.seq,self.timestamp,self.frame
+
+    def get_frame(self):
+        if self.frame is None:
+            self.wait_frame()
+        return self.frame
+
+class FrameAnalysis:
+    # 单帧分析结果，同一帧的各个使用者共享，避免重复转换与计算
+
+    def __init__(self,seq,timestamp):
+        self.seq=seq
+        self.timestamp=timestamp # 采集时间
+        self.analyzed_at=None # 分析完成时间
+        self.hsv_roi=None
+        self.valid_mask=None
+        self.zone_mean=None
+        self.zone_median=None # 按需计算，见HSVProcessor.get_zone_stats(median=True)
+        self.zone_std=None
+        self.zone_count=None
+        self.coverage=None # 各区域掩膜覆盖率
+        self.zone_lab=None # 各区域CIE Lab均值，仅在启用Lab时计算
+        self.left_avg=None
+        self.middle_avg=None
+        self.right_avg=None
 
 class HSVProcessor:
 
@@ -47,63 +324,246 @@ class HSVProcessor:
         self.hsv_lower = np.array([0, 0, 0])
         self.hsv_upper = np.array([179, 255, 255])
         self.frame=None
+        self.frame_seq=None
+        self.frame_ts=None
         self.frame_copy=None
+        self.preview_seq=0
+        self.preview_cond=threading.Condition()
+        self.analysis=None
         self.usemask=True
+        self.zone_grid = (1, 3) # 取样区域划分（行, 列），默认左、中、右三等分
+        self.white_roi = None # 白色参考块(x, y, w, h)，为空时不做光照补偿
+        self.white_reference = None # 取参考颜色时白色参考块的BGR均值
+        self.lab = False # 是否同时统计各区域的CIE Lab均值
+        self.zone_lab = None
+        self.hue_integral = None # 色相单位向量(cos, sin)的积分图，用于环形均值
+        self.lab_integral = None
+        self.zone_mean = None
+        self.zone_median = None
+        self.zone_std = None
+        self.zone_count = None
+        self.hsv_roi = None
+        self.valid_mask = None
+        self.hsv_integral = None # 取样区域内掩膜后HSV的积分图
+        self.hsv_sq_integral = None
+        self.mask_integral = None
+        self._stats_frame = None
+        self._stats_key = None
+        self._zone_stats = None
         self.left_avg = None
         self.middle_avg = None
         self.right_avg = None
         self.mp=None
 
-    def get_hsv_values(self):
-        # 转换为HSV
-        hsv_frame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2HSV)
-
+    def zone_geometry(self):
+        # 按zone_grid将取样区域划分为rows*cols个区域，返回(x, y, 区域宽, 区域高)
+        x, y, w, h = self.sample_roi
+        rows, cols = self.zone_grid
+        return x, y, w // cols, h // rows
+
+    def center_zone(self):
+        # 中心区域的序号（行优先），三等分时即中间部分
+        rows, cols = self.zone_grid
+        return (rows // 2) * cols + cols // 2
+
+    def white_mean(self):
+        # 当前帧白色参考块的BGR均值
+        x, y, w, h = self.white_roi
+        return np.array(cv2.mean(self.frame[y:y + h, x:x + w])[:3])
+
+    def set_white_reference(self):
+        # 以当前帧的白色参考块为基准，此后各帧按其变化对取样区域做逐通道增益补偿
+        self.white_reference = self.white_mean() if self.white_roi is not None else None
+
+    def _stats_key_now(self):
+        white = (self.white_roi, None if self.white_reference is None else tuple(self.white_reference))
+        return (self.sample_roi, self.usemask, tuple(self.hsv_lower), tuple(self.hsv_upper), white, self.lab)
+
+    def update_frame_stats(self):
+        # 每帧只执行一次：裁剪取样区域、转换HSV并建立积分图，此后任意矩形子区域的统计均为O(1)
+        stats_key = self._stats_key_now()
+        if self._stats_frame is self.frame and self._stats_key == stats_key:
+            return False
+
+        x, y, w, h = self.sample_roi
+        bgr_roi = self.frame[y:y + h, x:x + w]
+        if self.white_roi is not None and self.white_reference is not None:
+            # 白色参考块变暗或偏色时按比例还原（von Kries增益），整体光照变化不再被判为颜色变化
+            gain = self.white_reference / np.maximum(self.white_mean(), 1.0)
+            bgr_roi = cv2.transform(bgr_roi, np.diag(gain))
+        hsv_roi = cv2.cvtColor(bgr_roi, cv2.COLOR_BGR2HSV)
+
+        # 非黑色像素（V>0）参与计算，启用掩膜时再与HSV范围求交
+        valid_mask = hsv_roi[:, :, 2] > 0
         if self.usemask:
-            # 创建掩膜
-            mask = cv2.inRange(hsv_frame, self.hsv_lower, self.hsv_upper)
-            # 应用掩膜
-            masked_frame = cv2.bitwise_and(self.frame, self.frame, mask=mask)
-
-            # 将图像分为左、中、右三部分
-            x, y, w, h = self.sample_roi
-            part_width = w // 3
-
-            left_part = masked_frame[y:y + h, x:x + part_width]
-            middle_part = masked_frame[y:y + h, x + part_width:x + 2 * part_width]
-            right_part = masked_frame[y:y + h, x + 2 * part_width:x + 3 * part_width]
-
+            valid_mask &= cv2.inRange(hsv_roi, self.hsv_lower, self.hsv_upper) > 0
+        valid_u8 = valid_mask.astype(np.uint8)
+
+        # 掩膜外像素置零后求和与平方和积分图，另建掩膜积分图用于计数
+        masked_hsv = cv2.bitwise_and(hsv_roi, hsv_roi, mask=valid_u8)
+        self.hsv_integral, self.hsv_sq_integral = cv2.integral2(masked_hsv, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+        self.mask_integral = cv2.integral(valid_u8, sdepth=cv2.CV_64F)
+
+        # 色相在179与0之间相接，按单位圆坐标求和后再取角度，得到环形均值；
+        # 向量长度为饱和度，近无色像素的随机色相几乎不影响均值
+        hue = hsv_roi[:, :, 0]
+        saturation = hsv_roi[:, :, 1].astype(np.float32)
+        hue_vec = np.dstack([color_metric.HUE_COS[hue] * saturation, color_metric.HUE_SIN[hue] * saturation])
+        hue_vec[~valid_mask] = 0
+        self.hue_integral = cv2.integral(hue_vec, sdepth=cv2.CV_64F)
+
+        if self.lab:
+            lab_roi = cv2.cvtColor(bgr_roi.astype(np.float32) * (1 / 255), cv2.COLOR_BGR2Lab)
+            lab_roi[~valid_mask] = 0
+            self.lab_integral = cv2.integral(lab_roi, sdepth=cv2.CV_64F)
         else:
-            x, y, w, h = self.sample_roi
-            part_width = w // 3
-
-            left_part = hsv_frame[y:y + h, x:x + part_width]
-            middle_part = hsv_frame[y:y + h, x + part_width:x + 2 * part_width]
-            right_part = hsv_frame[y:y + h, x + 2 * part_width:x + 3 * part_width]
-
-        # 计算各部分的平均HSV值
-        left_hsv = cv2.cvtColor(left_part, cv2.COLOR_BGR2HSV)
-        middle_hsv = cv2.cvtColor(middle_part, cv2.COLOR_BGR2HSV)
-        right_hsv = cv2.cvtColor(right_part, cv2.COLOR_BGR2HSV)
+            self.lab_integral = None
+        self.hsv_roi = hsv_roi
+        self.valid_mask = valid_mask
+
+        self._stats_frame = self.frame
+        self._stats_key = stats_key
+        self._zone_stats = None
+        return True
+
+    def _rect_sum(self, integral, rects):
+        rects = np.asarray(rects, dtype=np.intp).reshape(-1, 4)
+        x0, y0 = rects[:, 0], rects[:, 1]
+        x1, y1 = x0 + rects[:, 2], y0 + rects[:, 3]
+        return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+    def region_stats(self, rects):
+        # rects为(K, 4)的(x, y, w, h)，坐标相对于取样区域；返回均值(K, 3)、标准差(K, 3)、有效像素数(K,)
+        # 色相的均值与标准差按环形统计
+        self.update_frame_stats()
+        count = self._rect_sum(self.mask_integral, rects)
+        safe_count = np.maximum(count, 1)[:, None]
+        mean = self._rect_sum(self.hsv_integral, rects) / safe_count
+        sq_mean = self._rect_sum(self.hsv_sq_integral, rects) / safe_count
+        std = np.sqrt(np.maximum(sq_mean - mean * mean, 0))
+
+        # 饱和度之和即色相向量的权重之和
+        hue_sum = self._rect_sum(self.hue_integral, rects)
+        saturation_sum = mean[:, 1] * np.maximum(count, 1)
+        mean[:, 0] = color_metric.hue_from_vector(hue_sum[:, 0], hue_sum[:, 1])
+        std[:, 0] = np.where(saturation_sum > 0, color_metric.hue_std_from_vector(hue_sum[:, 0], hue_sum[:, 1], saturation_sum), 0)
+
+        return mean, std, count
+
+    def region_lab(self, rects):
+        # 各矩形区域的CIE Lab均值(K, 3)，需启用lab
+        self.update_frame_stats()
+        count = self._rect_sum(self.mask_integral, rects)
+        return self._rect_sum(self.lab_integral, rects) / np.maximum(count, 1)[:, None]
+
+    def zone_rects(self):
+        # 各区域相对于取样区域的矩形(K, 4)，行优先
+        rows, cols = self.zone_grid
+        x, y, zone_w, zone_h = self.zone_geometry()
+        jj, ii = np.meshgrid(np.arange(rows), np.arange(cols), indexing='ij')
+        return np.stack([ii.ravel() * zone_w, jj.ravel() * zone_h,
+                         np.full(rows * cols, zone_w), np.full(rows * cols, zone_h)], axis=1)
+
+    def get_zone_stats(self, median=False):
+        # 所有区域的均值、中位数、标准差，均为(K, 3)数组；同一帧只计算一次
+        # 中位数须对区域内全部像素排序，无法由积分图得到，只在median为真时计算，否则为None
+        self.update_frame_stats()
+        if self._zone_stats is None:
+            zone_mean, zone_std, zone_count = self.region_stats(self.zone_rects())
+            self.zone_lab = self.region_lab(self.zone_rects()) if self.lab else None
+
+            self.zone_mean=zone_mean
+            self.zone_median=None
+            self.zone_std=zone_std
+            self.zone_count=zone_count
+            self.left_avg, self.middle_avg, self.right_avg = self.split_lmr(zone_mean)
+            self._zone_stats = (zone_mean, None, zone_std)
+
+        if median and self.zone_median is None and self.hsv_roi is not None:
+            self.zone_median = self._zone_median(self.zone_mean)
+            self._zone_stats = (self.zone_mean, self.zone_median, self.zone_std)
+        return self._zone_stats
+
+    def _zone_median(self, zone_mean):
+        # 重排为(K, 区域像素数, 3)后一次计算，K=rows*cols
+        rows, cols = self.zone_grid
+        x, y, zone_w, zone_h = self.zone_geometry()
+        k = rows * cols
+        zones = self.hsv_roi[:rows * zone_h, :cols * zone_w].reshape(rows, zone_h, cols, zone_w, 3).transpose(0, 2, 1, 3, 4).reshape(k, -1, 3)
+        weights = self.valid_mask[:rows * zone_h, :cols * zone_w].reshape(rows, zone_h, cols, zone_w).transpose(0, 2, 1, 3).reshape(k, -1)
+        zones = zones.astype(np.float32)
+        # 色相先以环形均值为中心展开，再求中位数
+        zones[:, :, 0] = zone_mean[:, None, 0] + color_metric.wrap_hue(zones[:, :, 0] - zone_mean[:, None, 0])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # 无有效像素的区域
+            zone_median = np.nanmedian(np.where(weights[:, :, None], zones, np.nan), axis=1)
+        zone_median = np.nan_to_num(zone_median).astype(np.float64)
+        zone_median[:, 0] %= color_metric.HUE_PERIOD
+        return zone_median
+
+    def split_lmr(self, zone_values):
+        # 将(K, 3)的区域HSV数值按列汇总为左、中、右三组
+        rows, cols = self.zone_grid
+        columns = color_metric.hsv_mean(zone_values.reshape(rows, cols, 3), axis=0)
+        return columns[0], columns[cols // 2], columns[-1]
 
-        # 计算平均值
-        def avg_hsv_nonblack(hsv_img):
-            # 创建非黑色掩膜
-            non_black_mask = np.any(hsv_img != [0, 0, 0], axis=-1)
-            if np.any(non_black_mask):
-                return np.mean(hsv_img[non_black_mask], axis=0)
-            return np.array([0, 0, 0])
-
-        left_avg = avg_hsv_nonblack(left_hsv)
-        middle_avg = avg_hsv_nonblack(middle_hsv)
-        right_avg = avg_hsv_nonblack(right_hsv)
-
-        self.left_avg=left_avg
-        self.middle_avg=middle_avg
-        self.right_avg=right_avg
+    def get_hsv_values(self):
+        self.get_zone_stats()
+        return self.left_avg, self.middle_avg, self.right_avg
 
-        return left_avg, middle_avg, right_avg
+    def set_frame(self,frame,seq=None,timestamp=None):
+        self.frame=frame
+        self.frame_seq=seq
+        self.frame_ts=timestamp
+
+    def analyze(self):
+        # 返回当前帧的分析结果，同一帧（序号）只计算一次
+        recomputed = self.update_frame_stats()
+        if not recomputed and self.analysis is not None and self.analysis.seq == self.frame_seq:
+            return self.analysis
+
+        zone_mean, zone_median, zone_std = self.get_zone_stats()
+        x, y, zone_w, zone_h = self.zone_geometry()
+
+        analysis = FrameAnalysis(self.frame_seq, self.frame_ts)
+        analysis.hsv_roi = self.hsv_roi
+        analysis.valid_mask = self.valid_mask
+        analysis.zone_mean = zone_mean
+        analysis.zone_median = zone_median
+        analysis.zone_std = zone_std
+        analysis.zone_count = self.zone_count
+        analysis.coverage = self.zone_count / max(zone_w * zone_h, 1)
+        analysis.zone_lab = self.zone_lab
+        analysis.left_avg, analysis.middle_avg, analysis.right_avg = self.left_avg, self.middle_avg, self.right_avg
+        analysis.analyzed_at = time.monotonic()
+
+        self.analysis = analysis
+        return analysis
+
+    def set_analysis(self, analysis):
+        # 采用外部（如分析进程）对当前帧给出的区域统计，此后analyze()直接返回该结果
+        stats_key = self._stats_key_now()
+        self.zone_mean = analysis.zone_mean
+        self.zone_median = analysis.zone_median
+        self.zone_std = analysis.zone_std
+        self.zone_count = analysis.zone_count
+        self.zone_lab = analysis.zone_lab
+        self.left_avg, self.middle_avg, self.right_avg = self.split_lmr(analysis.zone_mean)
+        analysis.left_avg, analysis.middle_avg, analysis.right_avg = self.left_avg, self.middle_avg, self.right_avg
+        # 本进程中没有该帧的HSV图像和积分图，清空以免误用上一帧的数据
+        self.hsv_roi = None
+        self.valid_mask = None
+        self.hsv_integral = self.hsv_sq_integral = self.mask_integral = None
+        self.hue_integral = self.lab_integral = None
+        self._stats_frame = self.frame
+        self._stats_key = stats_key
+        self._zone_stats = (analysis.zone_mean, analysis.zone_median, analysis.zone_std)
+        self.analysis = analysis
 
     def show_frame_window(self):
+        # 分析结果按帧缓存，显示的数值与判定使用的一致；self.frame同时供滴定线程分析，须在副本上绘制
+        if self.sample_roi is not None and self.frame_seq is not None:
+            self.analyze()
         frame_copy=self.frame.copy()
 
         # 显示取样区域
@@ -112,9 +572,12 @@ class HSVProcessor:
             cv2.rectangle(frame_copy, (x, y), (x + w, y + h), (0, 255, 0), 2)
             
             # 绘制分割线
-            part_width = w // 3
-            cv2.line(frame_copy, (x + part_width, y), (x + part_width, y + h), (255, 0, 0), 1)
-            cv2.line(frame_copy, (x + 2 * part_width, y), (x + 2 * part_width, y + h), (255, 0, 0), 1)
+            rows, cols = self.zone_grid
+            x, y, zone_w, zone_h = self.zone_geometry()
+            for i in range(1, cols):
+                cv2.line(frame_copy, (x + i * zone_w, y), (x + i * zone_w, y + h), (255, 0, 0), 1)
+            for j in range(1, rows):
+                cv2.line(frame_copy, (x, y + j * zone_h), (x + w, y + j * zone_h), (255, 0, 0), 1)
 
         # 在图像上显示HSV值
         if self.left_avg is not None and self.middle_avg is not None and self.right_avg is not None:
@@ -134,10 +597,21 @@ class HSVProcessor:
             cv2.putText(frame_copy, middle_text, (20, 60), font, font_scale, color, thickness)
             cv2.putText(frame_copy, right_text, (20, 90), font, font_scale, color, thickness)
 
-        self.frame_copy=frame_copy
+        # 发布新的预览帧并唤醒视频流编码线程
+        with self.preview_cond:
+            self.frame_copy=frame_copy
+            self.preview_seq+=1
+            self.preview_cond.notify_all()
 
         return frame_copy
 
+    def wait_preview(self,last_seq,timeout=0.5):
+        # 等待预览帧序号变化，返回(序号, 预览帧)，超时则返回当前值
+        with self.preview_cond:
+            if self.preview_seq==last_seq:
+                self.preview_cond.wait(timeout)
+            return self.preview_seq,self.frame_copy
+
     def create_roi_mask(self):
         frame_copy = self.frame.copy()
 
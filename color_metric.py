@@ -0,0 +1,137 @@
+# 化学笺集自动化滴定项目的一部分，用于颜色差异计算：环形色相均值/距离及CIE Lab ΔE2000
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import cv2
+import numpy as np
+
+# OpenCV中8位图像的色相范围为0~179，179与0相邻
+HUE_PERIOD=180.0
+# 无色、淡色溶液的色相主要由噪声决定：饱和度不高于HUE_SATURATION_FLOOR时不比较色相，
+# 至HUE_SATURATION_FULL之间色相差的权重线性增加
+HUE_SATURATION_FLOOR=15.0
+HUE_SATURATION_FULL=45.0
+
+# 色相到单位圆坐标的查找表，按像素取表即可完成整幅取样区域的转换
+_angles=np.arange(256)*(2*np.pi/HUE_PERIOD)
+HUE_COS=np.cos(_angles).astype(np.float32)
+HUE_SIN=np.sin(_angles).astype(np.float32)
+
+def wrap_hue(delta):
+    # 将色相差折叠到[-90, 90)
+    return (np.asarray(delta)+HUE_PERIOD/2)%HUE_PERIOD-HUE_PERIOD/2
+
+def hue_distance(a,b):
+    # 环形色相距离，取值0~90
+    return np.abs(wrap_hue(np.asarray(a,dtype=np.float64)-np.asarray(b,dtype=np.float64)))
+
+def hue_weight(s_a,s_b):
+    # 色相差的权重0~1，取两者中较低的饱和度；一方接近无色时色相差不参与判定，由饱和度差反映
+    s=np.minimum(s_a,s_b)
+    return np.clip((s-HUE_SATURATION_FLOOR)/(HUE_SATURATION_FULL-HUE_SATURATION_FLOOR),0.0,1.0)
+
+def hsv_distance(a,b):
+    # (..., 3)的HSV各通道差异，色相按环形计算并按饱和度加权
+    a=np.asarray(a,dtype=np.float64)
+    b=np.asarray(b,dtype=np.float64)
+    diff=np.abs(a-b)
+    diff[...,0]=hue_distance(a[...,0],b[...,0])*hue_weight(a[...,1],b[...,1])
+    return diff
+
+def hue_from_vector(sum_cos,sum_sin):
+    # 由单位向量之和得到色相均值，取值0~180
+    return np.degrees(np.arctan2(sum_sin,sum_cos))%360/2
+
+def hue_std_from_vector(sum_cos,sum_sin,count):
+    # 环形标准差sqrt(-2 ln R)，R为平均向量长度，换算为色相单位；加权时count为权重之和
+    r=np.hypot(sum_cos,sum_sin)/np.maximum(count,1e-12)
+    return np.sqrt(-2*np.log(np.clip(r,1e-12,1.0)))*HUE_PERIOD/(2*np.pi)
+
+def circular_hue_mean(hue,axis=None,weights=None):
+    # 色相的环形均值，避免红色在179与0之间被平均为青色
+    angles=np.asarray(hue,dtype=np.float64)*(2*np.pi/HUE_PERIOD)
+    if weights is None:
+        weights=np.ones_like(angles)
+    return hue_from_vector((np.cos(angles)*weights).sum(axis=axis),(np.sin(angles)*weights).sum(axis=axis))
+
+def hsv_mean(values,axis=0):
+    # HSV数值的均值，色相为按饱和度加权的环形均值
+    values=np.asarray(values,dtype=np.float64)
+    mean=values.mean(axis=axis)
+    mean[...,0]=circular_hue_mean(values[...,0],axis=axis,weights=values[...,1])
+    return mean
+
+def delta_e2000(lab1,lab2,terms=False):
+    # CIEDE2000色差，lab为(..., 3)的L*a*b*（L 0~100）；terms为真时同时返回
+    # 加权后的色相、彩度、明度三项(..., 3)，顺序与H、S、V对应
+    lab1=np.asarray(lab1,dtype=np.float64)
+    lab2=np.asarray(lab2,dtype=np.float64)
+    l1,a1,b1=lab1[...,0],lab1[...,1],lab1[...,2]
+    l2,a2,b2=lab2[...,0],lab2[...,1],lab2[...,2]
+
+    c_bar=(np.hypot(a1,b1)+np.hypot(a2,b2))/2
+    c7=c_bar**7
+    g=0.5*(1-np.sqrt(c7/(c7+25.0**7)))
+    a1p,a2p=(1+g)*a1,(1+g)*a2
+    c1p,c2p=np.hypot(a1p,b1),np.hypot(a2p,b2)
+    h1p=np.degrees(np.arctan2(b1,a1p))%360
+    h2p=np.degrees(np.arctan2(b2,a2p))%360
+    chroma_zero=(c1p*c2p)==0
+
+    dlp=l2-l1
+    dcp=c2p-c1p
+    dhp=h2p-h1p
+    dhp=np.where(dhp>180,dhp-360,np.where(dhp<-180,dhp+360,dhp))
+    dhp=np.where(chroma_zero,0.0,dhp)
+    dhp_big=2*np.sqrt(c1p*c2p)*np.sin(np.radians(dhp/2))
+
+    l_bar=(l1+l2)/2
+    cp_bar=(c1p+c2p)/2
+    h_sum=h1p+h2p
+    hp_bar=np.where(chroma_zero,h_sum,
+                    np.where(np.abs(h1p-h2p)<=180,h_sum/2,
+                             np.where(h_sum<360,(h_sum+360)/2,(h_sum-360)/2)))
+
+    t=(1-0.17*np.cos(np.radians(hp_bar-30))+0.24*np.cos(np.radians(2*hp_bar))
+       +0.32*np.cos(np.radians(3*hp_bar+6))-0.20*np.cos(np.radians(4*hp_bar-63)))
+    d_theta=30*np.exp(-((hp_bar-275)/25)**2)
+    cp7=cp_bar**7
+    r_c=2*np.sqrt(cp7/(cp7+25.0**7))
+    s_l=1+0.015*(l_bar-50)**2/np.sqrt(20+(l_bar-50)**2)
+    s_c=1+0.045*cp_bar
+    s_h=1+0.015*cp_bar*t
+    r_t=-np.sin(np.radians(2*d_theta))*r_c
+
+    l_term=dlp/s_l
+    c_term=dcp/s_c
+    h_term=dhp_big/s_h
+    delta_e=np.sqrt(np.maximum(l_term**2+c_term**2+h_term**2+r_t*c_term*h_term,0))
+    if terms:
+        return delta_e,np.abs(np.stack([h_term,c_term,l_term],axis=-1))
+    return delta_e
+
+def hsv_chroma(hsv):
+    # HSV在色度平面上的坐标(..., 2)：以饱和度为半径、色相为角度，色相环绕自然处理，不受明度影响
+    hsv=np.asarray(hsv,dtype=np.float64)
+    angles=hsv[...,0]*(2*np.pi/HUE_PERIOD)
+    return np.stack([hsv[...,1]*np.cos(angles),hsv[...,1]*np.sin(angles)],axis=-1)
+
+def target_progress(current,start,target):
+    # 当前颜色在起始颜色→目标颜色连线上的投影比例，以及到起始、目标颜色的距离，输入为(..., 2)色度坐标
+    axis=target-start
+    length2=np.maximum((axis*axis).sum(axis=-1),1e-12)
+    progress=np.clip(((current-start)*axis).sum(axis=-1)/length2,0.0,1.0)
+    d_start=np.linalg.norm(current-start,axis=-1)
+    d_target=np.linalg.norm(current-target,axis=-1)
+    return progress,d_start,d_target
+
+def hex_to_hsv(hex_color):
+    # '#RRGGBB'转为OpenCV的HSV
+    hex_color = hex_color.strip().lstrip('#')
+    r = int(hex_color[0:2], 16)
+    g = int(hex_color[2:4], 16)
+    b = int(hex_color[4:6], 16)
+    bgr_array = np.uint8([[[b, g, r]]])
+    hsv_array = cv2.cvtColor(bgr_array, cv2.COLOR_BGR2HSV)
+    h, s, v = hsv_array[0][0]
+    return [h, s, v]
@@ -1,21 +1,111 @@
 # 化学笺集自动化滴定项目的一部分，用于连接大模型
 # 作者：李峙德
 # 邮箱：contact@chemview.net
-# 最后更新：2025-10-24
-import requests
+# 最后更新：2026-10-18
+import os
+import re
 import json
+import argparse
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
 
 config_file='config.json'
-with open(config_file, 'r') as f:
-    config = json.load(f)
+cache_file='llm_cache.json' # 预测结果的本地缓存，键为规范化后的实验体系
+model='Pro/deepseek-ai/DeepSeek-V3'
+timeout=(5, 30) # 连接、读取超时（秒）
 
-req_url=config['req_url']
-api_key=config['api_key']
+_config=None
+_cache=None
+_session=None
+_executor=None
+_lock=threading.Lock()
 
-def llm_get_color(substance_name):
-    llm_req_url = req_url
+HEX_PATTERN=re.compile(r'#?([0-9A-Fa-f]{6})\b')
+
+def load_config():
+    # 首次需要时读取配置，导入本模块不再依赖config.json
+    global _config
+    if _config is None:
+        config={}
+        if os.path.exists(config_file):
+            with open(config_file, 'r') as f:
+                config=json.load(f)
+        _config=config
+    return _config
+
+def configure(req_url=None, api_key=None, cache=None):
+    # 覆盖配置文件中的接口地址、密钥或缓存文件，例如指向本地测试服务
+    global cache_file, _cache
+    config=load_config()
+    if req_url is not None:
+        config['req_url']=req_url
+    if api_key is not None:
+        config['api_key']=api_key
+    if cache is not None:
+        with _lock:
+            cache_file=cache
+            _cache=None
+
+def normalize_exptype(exptype):
+    # 全角转半角、统一大小写与空白，使同一体系的不同写法命中同一缓存
+    text=unicodedata.normalize('NFKC', str(exptype)).strip().lower()
+    return re.sub(r'\s+', ' ', text)
+
+def parse_color(content):
+    # 从模型回复中取出十六进制颜色，统一为#RRGGBB
+    match=HEX_PATTERN.search(content or '')
+    if not match:
+        raise Exception('LLMInvalidColor')
+    return '#'+match.group(1).upper()
+
+def _load_cache():
+    global _cache
+    if _cache is None:
+        _cache={}
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    _cache=json.load(f)
+            except Exception:
+                _cache={}
+    return _cache
+
+def cached_color(exptype):
+    with _lock:
+        return _load_cache().get(normalize_exptype(exptype))
+
+def _store(exptype, color):
+    with _lock:
+        cache=_load_cache()
+        cache[normalize_exptype(exptype)]=color
+        if cache_file:
+            # 先写临时文件再替换，避免中断时损坏缓存
+            tmp=cache_file+'.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False, indent=4)
+            os.replace(tmp, cache_file)
+
+def _get_session():
+    # 复用连接，避免每次预测重新建立TLS连接
+    global _session
+    with _lock:
+        if _session is None:
+            _session=requests.Session()
+            adapter=HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=1)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+def request_color(substance_name):
+    config=load_config()
+    llm_req_url = config.get('req_url', '')
+    if not llm_req_url:
+        raise Exception('LLMNotConfigured')
     llm_payload = {
-        "model": "Pro/deepseek-ai/DeepSeek-V3",
+        "model": model,
         "messages": [
             {
                 "role": "user",
@@ -24,9 +114,58 @@ def llm_get_color(substance_name):
         ]
     }
     llm_req_headers = {
-        "Authorization": f"Bearer {api_key}",
+        "Authorization": f"Bearer {config.get('api_key', '')}",
         "Content-Type": "application/json"
     }
-    llm_response=requests.request("POST", llm_req_url, json=llm_payload, headers=llm_req_headers)
-    llm_response_content=json.loads(llm_response.text)["choices"][0]["message"]["content"]
-    return llm_response_content
\ No newline at end of file
+    llm_response=_get_session().post(llm_req_url, json=llm_payload, headers=llm_req_headers, timeout=timeout)
+    llm_response.raise_for_status()
+    llm_response_content=llm_response.json()["choices"][0]["message"]["content"]
+    return parse_color(llm_response_content)
+
+def llm_get_color(substance_name):
+    # 先查本地缓存，未命中时请求大模型并写入缓存
+    color=cached_color(substance_name)
+    if color:
+        return color
+    color=request_color(substance_name)
+    _store(substance_name, color)
+    return color
+
+def submit(fn, *args):
+    # 在后台线程中执行预测等耗时操作，返回Future
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor=ThreadPoolExecutor(max_workers=2, thread_name_prefix='llm')
+    return _executor.submit(fn, *args)
+
+def predict_async(substance_name):
+    return submit(llm_get_color, substance_name)
+
+def serve_stub(color='#FF66CC', host='127.0.0.1', port=8919):
+    # 本地测试服务：按OpenAI兼容格式返回固定颜色，配合configure(req_url=...)使用
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            body=json.dumps({'choices': [{'message': {'role': 'assistant', 'content': color}}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server=ThreadingHTTPServer((host, port), StubHandler)
+    return server
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='大模型终点颜色预测的本地测试服务')
+    parser.add_argument('--color', default='#FF66CC')
+    parser.add_argument('--port', type=int, default=8919)
+    args=parser.parse_args()
+    print(f'http://127.0.0.1:{args.port}/')
+    serve_stub(args.color, port=args.port).serve_forever()
@@ -0,0 +1,222 @@
+# 化学笺集自动化滴定项目的一部分，用于离线查询常见指示剂体系的终点颜色及默认判定参数
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import re
+import sys
+import difflib
+import color_metric
+from ds_connect import normalize_exptype
+
+# 滴定液类别，按实验体系中第一个可识别的物质判断滴定方向
+TITRANTS={
+    'acid': ['hcl', '盐酸', 'h2so4', '硫酸', 'hno3', '硝酸', 'hclo4', '高氯酸', 'hac', 'ch3cooh', '醋酸', '乙酸',
+             'h2c2o4', '草酸'],
+    'base': ['naoh', '氢氧化钠', 'koh', '氢氧化钾', 'nh3', 'nh3·h2o', '氨水', 'na2co3', '碳酸钠', '硼砂'],
+    'edta': ['edta', 'na2h2y', '乙二胺四乙酸', '乙二胺四乙酸二钠'],
+    'iodine': ['i2', '碘', '碘液', '碘溶液', '碘标准溶液'],
+    'thiosulfate': ['na2s2o3', '硫代硫酸钠'],
+    'kmno4': ['kmno4', '高锰酸钾'],
+    'dichromate': ['k2cr2o7', '重铬酸钾'],
+    'cerium': ['ce(so4)2', 'ce4+', '硫酸铈'],
+    'silver': ['agno3', '硝酸银'],
+    'thiocyanate': ['kscn', 'nh4scn', '硫氰酸钾', '硫氰酸铵'],
+}
+
+# 稀溶液、日光下的典型颜色。variants按滴定液类别区分变色方向，第一个为滴定液无法识别时的默认值；
+# trajectory为起始到终点的颜色轨迹；color_metric与threshold为该体系推荐的判定方式和阈值
+# （hsv为HSV单位，lab为ΔE2000），褪色类终点色相不稳定，使用lab
+INDICATORS=[
+    {'name': '酚酞', 'name_en': 'phenolphthalein',
+     'aliases': ['酚酞', 'phenolphthalein', 'phph', 'pp'],
+     'variants': {
+         'base': {'transition': '无色→浅粉红', 'trajectory': ['#F5F5F0', '#F8D6E4', '#F7B7D2'],
+                  'color_metric': 'hsv', 'threshold': 13},
+         'acid': {'transition': '粉红→无色', 'trajectory': ['#F06AAE', '#F4B3D0', '#F5F5F0'],
+                  'color_metric': 'lab', 'threshold': 8}}},
+    {'name': '百里酚酞', 'name_en': 'thymolphthalein',
+     'aliases': ['百里酚酞', 'thymolphthalein'],
+     'variants': {
+         'base': {'transition': '无色→浅蓝', 'trajectory': ['#F5F5F0', '#C4D2F0', '#8CA6E0'],
+                  'color_metric': 'hsv', 'threshold': 13},
+         'acid': {'transition': '蓝→无色', 'trajectory': ['#4F76D0', '#A9BDEA', '#F5F5F0'],
+                  'color_metric': 'lab', 'threshold': 8}}},
+    {'name': '甲基橙', 'name_en': 'methyl orange',
+     'aliases': ['甲基橙', 'methyl orange', 'methylorange', 'mo'],
+     'variants': {
+         'acid': {'transition': '黄→橙', 'trajectory': ['#F2C12E', '#F2A52E', '#F28A2E'],
+                  'color_metric': 'hsv', 'threshold': 8},
+         'base': {'transition': '红→橙', 'trajectory': ['#E8473A', '#EE6A33', '#F28A2E'],
+                  'color_metric': 'hsv', 'threshold': 8}}},
+    {'name': '甲基红', 'name_en': 'methyl red',
+     'aliases': ['甲基红', 'methyl red', 'methylred', 'mr'],
+     'variants': {
+         'acid': {'transition': '黄→橙红', 'trajectory': ['#F2D43A', '#F0A83A', '#EE7B3A'],
+                  'color_metric': 'hsv', 'threshold': 8},
+         'base': {'transition': '红→黄', 'trajectory': ['#E2383A', '#EC8A3A', '#F2C53A'],
+                  'color_metric': 'hsv', 'threshold': 10}}},
+    {'name': '甲基红-溴甲酚绿', 'name_en': 'methyl red-bromocresol green',
+     'aliases': ['甲基红-溴甲酚绿', '溴甲酚绿-甲基红', '甲基红溴甲酚绿', '溴甲酚绿甲基红',
+                 'methyl red-bromocresol green', 'bromocresol green-methyl red'],
+     'variants': {
+         'acid': {'transition': '绿→暗红', 'trajectory': ['#4FA05A', '#8A7A5A', '#A8324A'],
+                  'color_metric': 'hsv', 'threshold': 10},
+         'base': {'transition': '暗红→绿', 'trajectory': ['#A8324A', '#8A7A5A', '#4FA05A'],
+                  'color_metric': 'hsv', 'threshold': 10}}},
+    {'name': '溴甲酚绿', 'name_en': 'bromocresol green',
+     'aliases': ['溴甲酚绿', 'bromocresol green', 'bcg'],
+     'variants': {
+         'acid': {'transition': '蓝→绿', 'trajectory': ['#3B6FC4', '#4F8E96', '#6AAE6A'],
+                  'color_metric': 'hsv', 'threshold': 10},
+         'base': {'transition': '黄→绿', 'trajectory': ['#D9D43A', '#A2C24E', '#6AAE6A'],
+                  'color_metric': 'hsv', 'threshold': 10}}},
+    {'name': '溴百里酚蓝', 'name_en': 'bromothymol blue',
+     'aliases': ['溴百里酚蓝', '溴麝香草酚蓝', 'bromothymol blue', 'btb'],
+     'variants': {
+         'base': {'transition': '黄→绿', 'trajectory': ['#E6D44A', '#A8C452', '#5DAA5A'],
+                  'color_metric': 'hsv', 'threshold': 13},
+         'acid': {'transition': '蓝→绿', 'trajectory': ['#2F6FC0', '#468E8C', '#5DAA5A'],
+                  'color_metric': 'hsv', 'threshold': 13}}},
+    {'name': '铬黑T', 'name_en': 'eriochrome black t',
+     'aliases': ['铬黑t', 'eriochrome black t', 'erio t', 'ebt'],
+     'variants': {
+         'edta': {'transition': '酒红→纯蓝', 'trajectory': ['#9C2A52', '#6A3A88', '#2D4FA8'],
+                  'color_metric': 'hsv', 'threshold': 13}}},
+    {'name': '钙指示剂', 'name_en': 'calconcarboxylic acid',
+     'aliases': ['钙指示剂', '钙羧酸', 'calconcarboxylic acid', 'calcon', 'nn'],
+     'variants': {
+         'edta': {'transition': '酒红→纯蓝', 'trajectory': ['#A0305A', '#70408A', '#3050A8'],
+                  'color_metric': 'hsv', 'threshold': 13}}},
+    {'name': '二甲酚橙', 'name_en': 'xylenol orange',
+     'aliases': ['二甲酚橙', 'xylenol orange', 'xo'],
+     'variants': {
+         'edta': {'transition': '紫红→亮黄', 'trajectory': ['#B0305A', '#D87A46', '#F0C830'],
+                  'color_metric': 'hsv', 'threshold': 13}}},
+    {'name': '紫脲酸铵', 'name_en': 'murexide',
+     'aliases': ['紫脲酸铵', 'murexide'],
+     'variants': {
+         'edta': {'transition': '红→蓝紫', 'trajectory': ['#D0507A', '#A04890', '#7A3FA8'],
+                  'color_metric': 'hsv', 'threshold': 13}}},
+    {'name': '淀粉', 'name_en': 'starch',
+     'aliases': ['淀粉', '淀粉溶液', 'starch', 'starch-iodine', '淀粉-碘'],
+     'variants': {
+         'iodine': {'transition': '无色→蓝', 'trajectory': ['#F5F5F0', '#8F9BCC', '#2B3F9A'],
+                    'color_metric': 'hsv', 'threshold': 13},
+         'thiosulfate': {'transition': '蓝→无色', 'trajectory': ['#2B3F9A', '#8F9BCC', '#F5F5F0'],
+                         'color_metric': 'lab', 'threshold': 8}}},
+    {'name': '铬酸钾', 'name_en': 'potassium chromate',
+     'aliases': ['铬酸钾', 'k2cro4', 'potassium chromate'],
+     'variants': {
+         'silver': {'transition': '黄→砖红', 'trajectory': ['#F0D040', '#E09A3E', '#C8643C'],
+                    'color_metric': 'hsv', 'threshold': 10}}},
+    {'name': '铁铵矾', 'name_en': 'ferric ammonium sulfate',
+     'aliases': ['铁铵矾', '硫酸铁铵', 'ferric ammonium sulfate', 'ferric alum'],
+     'variants': {
+         'thiocyanate': {'transition': '无色→淡红', 'trajectory': ['#F5F5F0', '#EEC0B0', '#D9806A'],
+                         'color_metric': 'hsv', 'threshold': 10}}},
+    {'name': '邻二氮菲亚铁', 'name_en': 'ferroin',
+     'aliases': ['邻二氮菲亚铁', '邻二氮菲-亚铁', '邻菲罗啉亚铁', 'ferroin'],
+     'variants': {
+         'cerium': {'transition': '红→浅蓝', 'trajectory': ['#D0303A', '#B078A0', '#8FB8DA'],
+                    'color_metric': 'lab', 'threshold': 10}}},
+    {'name': '二苯胺磺酸钠', 'name_en': 'sodium diphenylamine sulfonate',
+     'aliases': ['二苯胺磺酸钠', 'diphenylamine sulfonate', 'sodium diphenylamine sulfonate'],
+     'variants': {
+         'dichromate': {'transition': '绿→紫', 'trajectory': ['#5A9A6A', '#6A6A7A', '#7A3A8A'],
+                        'color_metric': 'hsv', 'threshold': 13}}},
+    # 自身指示：体系中没有指示剂时按滴定液匹配
+    {'name': '高锰酸钾自身指示', 'name_en': 'permanganate (self-indicating)',
+     'aliases': ['自身指示', '自身指示剂'], 'titrant': 'kmno4',
+     'variants': {
+         'kmno4': {'transition': '无色→浅粉紫', 'trajectory': ['#F5F5F0', '#F4D2E4', '#F2B8D8'],
+                   'color_metric': 'hsv', 'threshold': 10}}},
+]
+
+SPLIT_PATTERN=re.compile(r'[\s,，;；、/]+|滴定|指示剂|为|用|以')
+
+def _tokens(text):
+    return [token for token in SPLIT_PATTERN.split(text) if token]
+
+def _short(alias):
+    # 较短的英文缩写（如mo、pp）只按整词匹配，避免误中化学式的一部分
+    return alias.isascii() and len(alias)<=4
+
+def find_titrant(text):
+    # 返回(滴定液类别, 在文本中匹配到的写法)，优先整词，其次按最长写法在词中查找
+    for token in _tokens(text):
+        for kind, aliases in TITRANTS.items():
+            if token in aliases:
+                return kind, token
+        best=None
+        for kind, aliases in TITRANTS.items():
+            for alias in aliases:
+                if not _short(alias) and alias in token and (best is None or len(alias)>len(best[1])):
+                    best=(kind, alias)
+        if best:
+            return best
+    return None, None
+
+def _match_indicator(text, cutoff, margin):
+    # 先精确查找，再做模糊匹配；返回(条目, 匹配的写法, 相似度)
+    tokens=_tokens(text)
+    best=None
+    for entry in INDICATORS:
+        for alias in entry['aliases']:
+            found=alias in tokens if _short(alias) else alias in text
+            if found and (best is None or len(alias)>len(best[1])):
+                best=(entry, alias, 1.0)
+    if best:
+        return best
+    # 相邻1~3个词拼接后与各写法比较，多词写法（如methyl orange）须整体相近，单个methyl不会匹配到甲基红；
+    # 每个指示剂取最高分，最高分须达到cutoff且比其他指示剂高出margin，否则视为未找到，交给大模型
+    scores={}
+    for n in range(1, 4):
+        for i in range(len(tokens)-n+1):
+            phrase=' '.join(tokens[i:i+n])
+            for entry in INDICATORS:
+                for alias in entry['aliases']:
+                    if _short(alias):
+                        continue
+                    score=difflib.SequenceMatcher(None, phrase, alias).ratio()
+                    if entry['name'] not in scores or score>scores[entry['name']][2]:
+                        scores[entry['name']]=(entry, alias, score)
+    ranked=sorted(scores.values(), key=lambda match: match[2], reverse=True)
+    if not ranked or ranked[0][2]<cutoff:
+        return None
+    if len(ranked)>1 and ranked[1][2]>ranked[0][2]-margin:
+        return None
+    return ranked[0]
+
+def _hsv(hex_color):
+    return [int(v) for v in color_metric.hex_to_hsv(hex_color)]
+
+def lookup(exptype, cutoff=0.85, margin=0.05):
+    # 按“滴定液 被滴定液 指示剂”查询终点颜色，未找到时返回None
+    text=normalize_exptype(exptype)
+    titrant, titrant_alias=find_titrant(text)
+    # 滴定液的写法不参与指示剂匹配，例如重铬酸钾中的“铬酸钾”
+    indicator_text=text.replace(titrant_alias, ' ', 1) if titrant_alias else text
+    matched=_match_indicator(indicator_text, cutoff, margin)
+    if matched is None:
+        self_indicating=[entry for entry in INDICATORS if entry.get('titrant') and entry['titrant']==titrant]
+        if not self_indicating:
+            return None
+        matched=(self_indicating[0], titrant_alias, 1.0)
+    entry, alias, score=matched
+    if entry.get('titrant') and entry['titrant']!=titrant:
+        return None
+    variants=entry['variants']
+    kind=titrant if titrant in variants else next(iter(variants))
+    variant=variants[kind]
+    trajectory=variant['trajectory']
+    return {'indicator': entry['name'], 'name_en': entry['name_en'], 'alias': alias, 'score': round(score, 3),
+            'titrant': kind, 'transition': variant['transition'],
+            'start': trajectory[0], 'endpoint': trajectory[-1],
+            'start_hsv': _hsv(trajectory[0]), 'endpoint_hsv': _hsv(trajectory[-1]),
+            'trajectory': list(trajectory), 'hue_trajectory': [_hsv(c)[0] for c in trajectory],
+            'color_metric': variant['color_metric'], 'threshold': variant['threshold']}
+
+if __name__=='__main__':
+    # python indicator_table.py "NaOH HCl 酚酞"
+    for exptype in sys.argv[1:]:
+        print(exptype, '->', lookup(exptype))
@@ -1,171 +1,146 @@
 # 化学笺集自动化滴定项目的主程序
 # 作者：李峙德，刘一弘
 # 邮箱：contact@chemview.net
-# 最后更新：2025-10-25
-import cv2
+# 最后更新：2026-10-18
 import time
 import threading
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, Blueprint, render_template, request, jsonify, Response
 import webview
-import numpy as np
 import os
 import json
 import logging
-import titration
-import message_process
+import station_process
 
 class Webview:
-    def __init__(self, titration_instance):
-        self.t=titration_instance
+    def __init__(self, manager):
+        self.manager=manager
+        self.port=manager.port
         self.app = Flask(__name__, template_folder='web', static_folder='web')
         log = logging.getLogger('werkzeug')
         log.disabled = True
-        self.setup_routes()
-        self.config_file = 'config.json'
-        self.load_config()
+        # 第一个工位挂载在根路径，所有工位同时挂载在/station/<序号>下
+        self.setup_routes(manager.stations[0], '', 'root')
+        for i, station in enumerate(manager.stations):
+            self.setup_routes(station, f'/station/{i}', f'station{i}')
         self.main_window = None
         self.child_windows = {}  # 用于管理子窗口
-        
-    def load_config(self):
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-                # 将配置应用到滴定实例
-                for key, value in config.items():
-                    if hasattr(self.t, key):
-                        setattr(self.t, key, value)
-    
-    def save_config(self, config_data):
-        # 先读取现有配置
-        existing_config = {}
-        if os.path.exists(self.config_file):
-            with open(self.config_file, 'r') as f:
-                existing_config = json.load(f)
-        
-        # 合并配置
-        merged_config = {**existing_config,** config_data}
-        
-        # 保存合并后的配置
-        with open(self.config_file, 'w') as f:
-            json.dump(merged_config, f, indent=4)
-        
-        # 更新滴定实例的配置
-        for key, value in config_data.items():
-            if hasattr(self.t, key):
-                setattr(self.t, key, value)
-        
-        self.t.mp.log('gc',f'{merged_config}')
 
-    def generate_frames(self):
-        while True:
-            try:
-                # 检查滴定实例和摄像头是否可用
-                if (hasattr(self.t, 'cd') and self.t.cd and  
-                    hasattr(self.t.cd, 'proc') and self.t.cd.proc and 
-                    self.t.cd.proc.frame_copy is not None):
-                    
-                    frame = self.t.cd.proc.frame_copy
-                    
-                    # 调整帧大小以提高性能
-                    frame = cv2.resize(frame, (640, 480))
-                    
-                    # 将帧转换为JPEG格式
-                    ret, buffer = cv2.imencode('.jpg', frame, 
-                                             [cv2.IMWRITE_JPEG_QUALITY, 50])
-                    if ret:
-                        frame_bytes = buffer.tobytes()
-                        yield (b'--frame\r\n'
-                              b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                else:
-                    # 生成一个黑色帧作为占位符
-                    blank_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                    ret, buffer = cv2.imencode('.jpg', blank_frame)
-                    if ret:
-                        frame_bytes = buffer.tobytes()
-                        yield (b'--frame\r\n'
-                              b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                
-                time.sleep(0.04)
-                
-            except Exception as e:
-                self.t.mp.log('ve',f'{e}')
-                # 生成错误帧
-                error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                cv2.putText(error_frame, 'Camera Error', (200, 240), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                ret, buffer = cv2.imencode('.jpg', error_frame)
-                if ret:
-                    frame_bytes = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                          b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                time.sleep(1)
-    
-    def setup_routes(self):
+    def setup_routes(self, station, base, name):
+        bp = Blueprint(name, __name__)
         
-        @self.app.route('/')
+        def page(template):
+            return render_template(template, base=base, station=station.name)
+        
+        @bp.route('/')
         def index():
-            return render_template('index.html')
+            return page('index.html')
         
-        @self.app.route('/config')
+        @bp.route('/config')
         def config():
-            return render_template('config.html')
+            return page('config.html')
         
-        @self.app.route('/exp')
+        @bp.route('/exp')
         def exp():
-            return render_template('exp.html')
+            return page('exp.html')
         
-        @self.app.route('/debug')
+        @bp.route('/debug')
         def debug():
-            return render_template('debug.html')
+            return page('debug.html')
         
-        @self.app.route('/predict')
+        @bp.route('/predict')
         def predict():
-            return render_template('predict.html')
+            return page('predict.html')
         
-        @self.app.route('/about')
+        @bp.route('/about')
         def about():
-            return render_template('about.html')
+            return page('about.html')
         
-        @self.app.route('/api/status')
+        @bp.route('/api/status')
         def get_status():
-            return jsonify({
-                'message': getattr(self.t.mp, 'message', ''),
-                'predict_color': getattr(self.t, 'predict_color', '#9CA3AF'),
-                'time': f"{getattr(self.t, 'time', 0):.2f} s" if getattr(self.t, 'time', 0) > 0 else '--',
-                'volume': f"{getattr(self.t, 'volume', 0):.2f} mL",
-                'running': getattr(self.t, 'running', False),
-                'endpoint': getattr(self.t, 'endpoint', False)
-            })
+            return jsonify(station.status_snapshot())
+
+        @bp.route('/api/events')
+        def status_events():
+            return Response(station.status.stream(),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
         
-        @self.app.route('/api/start', methods=['POST'])
+        @bp.route('/api/start', methods=['POST'])
         def start_titration():
-            self.t.run()
+            station.t.run()
             return jsonify({'success': True})
         
-        @self.app.route('/api/stop', methods=['POST'])
+        @bp.route('/api/stop', methods=['POST'])
         def stop_titration():
-            self.t.stop()
+            if station.batch.running:
+                station.batch.stop()
+            else:
+                station.t.stop()
+            return jsonify({'success': True})
+
+        @bp.route('/api/camera')
+        def camera_report():
+            # 请求与实际的采集参数、实测帧率及抖动
+            cap = getattr(station.t, 'cap', None)
+            if cap is None or not hasattr(cap, 'report'):
+                return jsonify({})
+            return jsonify(cap.report())
+
+        @bp.route('/api/batch')
+        def batch_status():
+            return jsonify(station.batch.snapshot())
+
+        @bp.route('/api/batch/add', methods=['POST'])
+        def batch_add():
+            try:
+                # 可提交单个样品或样品列表：{"sample_id", "exptype", "rate", "volume_limit"}
+                samples = request.json
+                if isinstance(samples, dict):
+                    samples = [samples]
+                for sample in samples:
+                    station.batch.add(sample['sample_id'], sample.get('exptype'),
+                                      sample.get('rate'), sample.get('volume_limit'))
+                return jsonify({'success': True})
+            except Exception as e:
+                return jsonify({'success': False, 'error': str(e)})
+
+        @bp.route('/api/batch/start', methods=['POST'])
+        def batch_start():
+            try:
+                station.batch.start()
+                return jsonify({'success': True})
+            except Exception as e:
+                return jsonify({'success': False, 'error': str(e)})
+
+        @bp.route('/api/batch/stop', methods=['POST'])
+        def batch_stop():
+            station.batch.stop()
+            return jsonify({'success': True})
+
+        @bp.route('/api/batch/clear', methods=['POST'])
+        def batch_clear():
+            station.batch.clear()
             return jsonify({'success': True})
         
-        @self.app.route('/api/save_config', methods=['POST'])
+        @bp.route('/api/save_config', methods=['POST'])
         def save_config():
             try:
                 config_data = request.json
-                self.save_config(config_data)
+                station.save_config(config_data)
                 return jsonify({'success': True})
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
             
-        @self.app.route('/api/predict', methods=['POST'])
+        @bp.route('/api/predict', methods=['POST'])
         def llm_predict():
             try:
                 exptype = request.json['exptype']
-                self.t.llm_predict(exptype)
+                station.t.llm_predict_async(exptype)
                 return jsonify({'success': True})
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
         
-        @self.app.route('/api/open_help')
+        @bp.route('/api/open_help')
         def open_help():
             try:
                 help_file = 'help.pdf'
@@ -175,81 +150,89 @@ class Webview:
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
 
-        @self.app.route('/api/open_log_console')
+        @bp.route('/api/open_log_console')
         def open_log_console():
             try:
-                console_file = 'cat.log'
+                console_file = station.log_file
                 if os.path.exists(console_file):
                     os.startfile(console_file)
                 return jsonify({'success': True})
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
             
-        @self.app.route('/api/reload')
+        @bp.route('/api/reload')
         def reload():
-            self.t.release()
-            self.t.con()
+            station.t.release()
+            station.t.con()
             return jsonify({'success': True})
             
-        @self.app.route('/api/rinse')
+        @bp.route('/api/rinse')
         def rinse():
-            self.t.rinse()
+            station.t.rinse()
             return jsonify({'success': True})
             
-        @self.app.route('/api/get_config')
+        @bp.route('/api/get_config')
         def get_config():
             try:
                 config = {}
-                if os.path.exists(self.config_file):
-                    with open(self.config_file, 'r') as f:
+                if os.path.exists(station.config_file):
+                    with open(station.config_file, 'r') as f:
                         config = json.load(f)
-                        self.t.mp.log('ar',f'{config}')
+                        station.t.mp.log('ar',f'{config}')
                 else:
                     # 如果配置文件不存在，返回当前实例的配置
                     config = {
-                        'cap_num': getattr(self.t, 'cap_num', 0),
-                        'port': getattr(self.t, 'port', 'COM1'),
-                        'rate': getattr(self.t, 'rate', '05.00'),
-                        'threshold': getattr(self.t, 'threshold', 30),
-                        'threshold_times': getattr(self.t, 'threshold_times', 1.5),
-                        'usemask': getattr(self.t, 'usemask', True)
+                        'cap_num': getattr(station.t, 'cap_num', 0),
+                        'port': getattr(station.t, 'port', 'COM1'),
+                        'pump_model': getattr(station.t, 'pump_model', 'Arduino'),
+                        'rate': getattr(station.t, 'rate', '05.00'),
+                        'threshold': getattr(station.t, 'threshold', 30),
+                        'threshold_times': getattr(station.t, 'threshold_times', 1.5),
+                        'usemask': getattr(station.t, 'usemask', True),
+                        'zone_grid': getattr(station.t, 'zone_grid', [1, 3]),
+                        'cap_profile': getattr(station.t, 'cap_profile', None)
                     }
-                    self.t.mp.log('ar',f'{config}')
+                    station.t.mp.log('ar',f'{config}')
                 
                 return jsonify(config)
             except Exception as e:
                 return jsonify({'error': str(e)})
             
-        @self.app.route('/video_feed')
+        @bp.route('/video_feed')
         def video_feed():
-            return Response(self.generate_frames(), 
+            profile = request.args.get('profile', 'normal')
+            return Response(station.streamer.stream(profile), 
                         mimetype='multipart/x-mixed-replace; boundary=frame')
         
         # 添加新的API端点用于创建子窗口
-        @self.app.route('/api/open_window/<path:path>/<title>/<int:width>/<int:height>')
+        @bp.route('/api/open_window/<path:path>/<title>/<int:width>/<int:height>')
         def open_window(path, title, width, height):
             try:
                 # 检查窗口是否已存在，如果存在则关闭
-                if path in self.child_windows:
-                    self.child_windows[path].destroy()
+                key = f'{base}/{path}'
+                if key in self.child_windows:
+                    self.child_windows[key].destroy()
                 
                 # 创建新窗口，不使用parent参数
                 window = webview.create_window(
                     title,
-                    f'http://127.0.0.1:8917/{path}',
+                    f'http://127.0.0.1:{self.port}{key}',
                     width=width,
                     height=height,
                     resizable=False
                 )
                 
                 # 存储窗口引用
-                self.child_windows[path] = window
+                self.child_windows[key] = window
                 return jsonify({'success': True})
             except Exception as e:
-                self.t.mp.log('cw',f'{e}')
+                station.t.mp.log('cw',f'{e}')
+                return jsonify({'success': False, 'error': str(e)})
+
+        self.app.register_blueprint(bp, url_prefix=base or None)
 
     def run_flask(self):
-        self.app.run(host='127.0.0.1', port=8917, debug=False, use_reloader=False)
+        self.app.run(host='127.0.0.1', port=self.port, debug=False, use_reloader=False)
 
     def run(self):
         # 在后台启动Flask服务器
@@ -260,25 +243,31 @@ class Webview:
         # 等待服务器启动
         time.sleep(0.1)
         
-        self.t.con()
+        self.manager.con()
 
-        # 创建主窗口
-        self.main_window = webview.create_window(
-            '化学笺集自动化滴定项目',
-            'http://127.0.0.1:8917/',
-            width=1000,
-            height=700,
-            resizable=True
-        )
+        # 创建主窗口，多工位时为其余工位各创建一个窗口
+        stations = self.manager.stations
+        for i, station in enumerate(stations):
+            title = '化学笺集自动化滴定项目'
+            if len(stations) > 1:
+                title = f'{title} - {station.name}'
+            window = webview.create_window(
+                title,
+                f'http://127.0.0.1:{self.port}/' if i == 0 else f'http://127.0.0.1:{self.port}/station/{i}/',
+                width=1000,
+                height=700,
+                resizable=True
+            )
+            if self.main_window is None:
+                self.main_window = window
         
         # 启动webview
         webview.start()
 
 if __name__=='__main__':
     try:
-        t=titration.Titration()
-        t.mp=message_process.MessageProcessor()
-        webview_app=Webview(t)
+        manager=station_process.StationManager.from_file('stations.json')
+        webview_app=Webview(manager)
         webview_app.run()
     except Exception as e:
         print(f'错误：{e}')
\ No newline at end of file
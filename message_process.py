@@ -1,22 +1,118 @@
 # 化学笺集自动化滴定项目的一部分，用于实现消息提醒及日志记录
 # 作者：李峙德
 # 邮箱：contact@chemview.net
-# 最后更新：2025-10-25
-# send wa 等待 cs 硬件连接就绪 ce 硬件连接错误 te 滴定过程错误 se 停止错误 re 润洗错误 le 释放错误 i* 初始化平均颜色 f* 终点平均颜色 me 大模型预测错误
+# 最后更新：2026-10-18
+# send wa 等待 cs 硬件连接就绪 ce 硬件连接错误 te 滴定过程错误 se 停止错误 re 润洗错误 le 释放错误 i* 初始化平均颜色 f* 终点平均颜色及均匀性 me 大模型预测错误 be 批量任务错误
 # alert ep 滴定终点 rs 取样区域太小
-# log et 终点判定条件 ef 恢复原色 ri 润洗 rl 释放 pr 大模型预测 gc 配置已保存 ve 视频流生成错误 ar API返回配置 cw 创建窗口错误 ms 手动停止
-# box ru 正在滴定
+# log et 终点判定条件 ec 终点确认用时 ef 恢复原色 ri 润洗 rl 释放 pr 大模型预测 gc 配置已保存 ve 视频流生成错误 ar API返回配置 cw 创建窗口错误 ms 手动停止 we 记录写入错误 vl 达到体积上限 rf 等待补液 bs 批量开始 bj 批量样品开始 bd 批量样品结束 bf 批量结束 cp 摄像头实际采集参数 cm 摄像头未接受请求的规格 cj 摄像头帧率与抖动 tg 目标颜色方向 tn 目标颜色与起始颜色过近 it 指示剂表命中 id 采用指示剂推荐参数 eo 回放到达录像结尾
+# box ru 正在滴定 ep 滴定终点（批量滴定时） bd 批量样品结束
+import os
 import time
+import queue
+import atexit
+import threading
 import pymsgbox
 import plyer
 
+# 异步日志写入：调用方只入队，由后台线程批量写入，文件句柄保持打开
+class LogWriter:
+
+    def __init__(self, path='cat.log', max_bytes=5*1024*1024, backup_count=3, flush_interval=0.5, maxsize=10000):
+        self.path=path
+        self.max_bytes=max_bytes
+        self.backup_count=backup_count
+        self.flush_interval=flush_interval
+        self.queue=queue.Queue(maxsize=maxsize)
+        self.dropped=0 # 队列已满时丢弃的条数
+        self.file=None
+        self._closed=False
+        self._writer_thread = threading.Thread(target=self._run_writer)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+        atexit.register(self.close)
+
+    def write(self, line):
+        # 不阻塞调用方，队列满时丢弃并计数
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped+=1
+
+    def flush(self, timeout=2):
+        # 等待此前入队的日志全部写入磁盘
+        if self._closed:
+            return
+        done=threading.Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+            done.wait(timeout)
+        except queue.Full:
+            pass
+
+    def close(self):
+        if not self._closed:
+            self.flush()
+            self._closed=True
+
+    def _open(self):
+        if self.file is None:
+            self.file=open(self.path, 'a')
+
+    def _rotate(self):
+        # 按大小轮转：cat.log -> cat.log.1 -> ... -> cat.log.N
+        self.file.close()
+        self.file=None
+        for i in range(self.backup_count - 1, 0, -1):
+            src=f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def _run_writer(self):
+        while True:
+            batch=[]
+            waiters=[]
+            try:
+                item=self.queue.get(timeout=self.flush_interval)
+                while True:
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+                    item=self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            try:
+                if batch:
+                    self._open()
+                    if self.dropped:
+                        batch.append(f'\n{time.strftime("%H:%M:%S", time.localtime())} LOGDROPPED{self.dropped}')
+                        self.dropped=0
+                    self.file.write(''.join(batch))
+                    self.file.flush()
+                    if self.max_bytes and self.file.tell() >= self.max_bytes:
+                        self._rotate()
+            except Exception as e:
+                print(e)
+                self.file=None
+
+            for done in waiters:
+                done.set()
+
 class MessageProcessor:
 
-    def __init__(self):
+    def __init__(self, log_file='cat.log', quiet=False):
+        # log_file为空时不写日志；quiet为真时不弹出提示框与通知（离线回放等场景）
         self.message=None
-        self.webmsg={'wa':'等待', 'cs':'就绪', 'ce':'硬件连接错误', 'te':'滴定过程错误', 'se':'停止错误', 're':'润洗错误', 'le':'释放错误', 'me':'大模型预测错误'}
+        self.logger=LogWriter(log_file) if log_file else None
+        self.quiet=quiet
+        self.webmsg={'wa':'等待', 'cs':'就绪', 'ce':'硬件连接错误', 'te':'滴定过程错误', 'se':'停止错误', 're':'润洗错误', 'le':'释放错误', 'me':'大模型预测错误', 'be':'批量任务错误'}
         self.alertmsg={'ep':'到达滴定终点！消耗滴定液体积', 'rs':'取样区域太小，请重新选择！'}
-        self.boxmsg={'ru':'正在滴定...'}
+        self.boxmsg={'ru':'正在滴定...', 'ep':'到达滴定终点！消耗滴定液体积', 'bd':'样品滴定结束'}
         self.logmsg={'wa':'WAITING', 
                      'cs':'READY', 
                      'ce':'HWCONNECTIONERROR', 
@@ -27,6 +123,7 @@ class MessageProcessor:
                      'ep':'ENDPOINTVOLUME', 
                      'ru':'RUNTITRATION',  
                      'et':'NEARENDPOINT', 
+                     'ec':'ENDPOINTCONFIRMED', 
                      'ef':'COLORRECOVERED',
                      'ri':'RINSE', 
                      'rl':'RELEASE', 
@@ -37,6 +134,7 @@ class MessageProcessor:
                      'fl':'FINALLEFTHSVCOLOR', 
                      'fm':'FINALMIDDELHSVCOLOR', 
                      'fr':'FINALRIGHTHSVCOLOR', 
+                     'fh':'FINALHOMOGENEOUS', 
                      'gc':'GETSAVEDCONFIG', 
                      've':'VIDEOGENERATEERROR', 
                      'ar':'APIRETURNEDCONFIG', 
@@ -46,7 +144,23 @@ class MessageProcessor:
                      'ig':'INITIALRANGE', 
                      'rs':'ROIRANGETOOSMALL', 
                      'pe':'PREVIEWERROR', 
-                     'me':'LLMPREDICTERROR'}
+                     'me':'LLMPREDICTERROR', 
+                     'we':'RECORDWRITEERROR', 
+                     'vl':'VOLUMELIMIT', 
+                     'rf':'REFILL', 
+                     'bs':'BATCHSTART', 
+                     'bj':'BATCHJOB', 
+                     'bd':'BATCHJOBDONE', 
+                     'bf':'BATCHFINISHED', 
+                     'be':'BATCHERROR', 
+                     'cp':'CAPPROFILE', 
+                     'cm':'CAPPROFILEMISMATCH', 
+                     'cj':'CAPFRAMESTATS', 
+                     'tg':'TARGETCOLORAXIS', 
+                     'tn':'TARGETTOOCLOSE', 
+                     'it':'INDICATORTABLE', 
+                     'id':'INDICATORDEFAULTS',
+                     'eo':'ENDOFSTREAM'}
 
     def send(self, msg, d=''):
         try:
@@ -61,6 +175,8 @@ class MessageProcessor:
     def alert(self, msg, d=''):
         try:
             self.log(msg, d)
+            if self.quiet:
+                return
             if d:
                 pymsgbox.alert(text=f'{self.alertmsg[msg]}：{d}', title='化学笺集自动化滴定项目')
             else:
@@ -71,6 +187,8 @@ class MessageProcessor:
     def box(self, msg, d=''):
         try:
             self.log(msg, d)
+            if self.quiet:
+                return
             if d:
                 plyer.notification.notify(
                     title='化学笺集自动化滴定项目',
@@ -89,9 +207,14 @@ class MessageProcessor:
             print(e)
 
     def log(self, msg, d=''):
+        if self.logger is None:
+            return
         try:
             t=time.strftime('%H:%M:%S', time.localtime())
-            with open('cat.log', 'a') as file:
-                file.write(f'\n{t} {self.logmsg[msg]}{d}')
+            self.logger.write(f'\n{t} {self.logmsg[msg]}{d}')
         except Exception as e:
             print(e)
+
+    def flush(self):
+        if self.logger:
+            self.logger.flush()
@@ -2,66 +2,365 @@
 # 作者：李峙德
 # 邮箱：contact@chemview.net
 # 最后更新：2025-9-26
-import serial
+import re
+import abc
 import time
+import serial
+import threading
+import collections
+from concurrent.futures import Future
 
-# 串口控制
+# 串口控制：命令进入队列，由写线程按节拍发送并等待设备应答，调用方不阻塞
 class SerialPort:
-    def __init__(self, com, baud=9600, timeout=3):
+    def __init__(self, com, baud=9600, timeout=3, pacing=0.1, ack=None, settle=2.0, link=None):
         self.com = com
         self.baud = baud
-        self.timeout = timeout
-        self.serial_port = serial.Serial(com, baud)
-        time.sleep(2)
+        self.timeout = timeout # 等待应答的最长时间
+        self.pacing = pacing # 两条命令之间的最小间隔
+        self.ack = re.compile(ack) if ack else None # 应答格式，为空表示设备无应答
+        self.error = None
+        # link为虚拟串口（如模拟泵），否则打开真实串口
+        self.serial_port = link if link is not None else serial.Serial(com, baud, timeout=0.05)
+        self._ready_at = time.monotonic() + settle # 打开串口后设备复位所需时间
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._writer_thread = threading.Thread(target=self._run_writer)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
 
-    def send(self, command):
+    def send(self, command, callback=None, urgent=False):
+        # 命令入队后立即返回Future，其结果为设备应答；callback在完成后于写线程中调用
+        # urgent用于停止等命令：不受之前的发送错误影响，并清除排队中的普通命令（其Future被取消）后优先发送
+        if self.error is not None and not urgent:
+            # 错误只报告一次，之后的命令照常发送
+            error, self.error = self.error, None
+            raise error
         if not command.endswith('\n'):
             command += '\n'
-        self.serial_port.write(command.encode())
-        time.sleep(0.1)
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+        dropped = []
+        with self._cond:
+            if self._closed:
+                raise Exception('SerialPortClosed')
+            if urgent:
+                dropped = [item for item in self._pending if not item[2]]
+                self._pending = collections.deque(item for item in self._pending if item[2])
+            self._pending.append((command, future, urgent))
+            self._cond.notify()
+        for _, dropped_future, _ in dropped:
+            dropped_future.cancel()
+        return future
+
+    def _read_ack(self):
+        reply = b''
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            reply += self.serial_port.read(self.serial_port.in_waiting or 1)
+            if self.ack.search(reply):
+                return reply
+        raise Exception('SerialAckTimeout')
+
+    def _run_writer(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    break
+                command, future, _ = self._pending.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            delay = self._ready_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                if self.ack:
+                    self.serial_port.reset_input_buffer()
+                self.serial_port.write(command.encode())
+                reply = self._read_ack() if self.ack else b''
+                future.set_result(reply)
+            except Exception as e:
+                self.error = e
+                future.set_exception(e)
+            self._ready_at = time.monotonic() + self.pacing
 
     def close(self):
+        # 发送完队列中的命令后关闭串口
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._writer_thread.join(timeout=self.timeout + 1)
         self.serial_port.close()
 
 
-# 泵控制
-class Pump:
-    def __init__(self, port, model='Arduino'):
-        self.model = model
-        self.serial_port = SerialPort(port)
+# 泵驱动注册表：型号名 -> 驱动类，由配置中的pump_model选择
+pump_drivers = {}
 
-    def setrate(self, rate):
-        rate_lst = rate.split('.')
+def register_pump(name):
+    def decorator(cls):
+        cls.model = name
+        pump_drivers[name] = cls
+        return cls
+    return decorator
 
-        if self.model == 'QHZS':
-            self.serial_port.send(f'Q1H{rate_lst[0]}D')
-            self.serial_port.send(f'Q2H{rate_lst[1]}D')
-            self.serial_port.send('Q6H1D')
-        elif self.model == 'Harvard':
-            self.serial_port.send(f'MLM {float(rate)}')
-        elif self.model == 'Arduino':
-            if len(rate_lst[0]) == 1:  # 如果整数部分只有1位
-                rate_str = '0' + rate_lst[0] + rate_lst[1].ljust(2, '0')
-            else:
-                rate_str = rate_lst[0] + rate_lst[1].ljust(2, '0')
-            self.serial_port.send(f'SETRATE {rate_str}')
+def create_pump(port, model='Arduino', clock=time.monotonic):
+    if model not in pump_drivers:
+        raise Exception('UnknownPumpModel')
+    return pump_drivers[model](port, clock)
+
+
+# 体积计量：按启动、停止、改速命令完成的时刻积分滴加体积，任意时刻查询开销为O(1)
+class VolumeMeter:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.rate = 0.0 # mL/min
+        self.running = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # 清零累计量，泵的运行状态与速度保持不变
+        with self._lock:
+            self.volume = 0.0
+            self.time = 0.0
+            self._since = self.clock()
+
+    def _close(self, now):
+        if self.running:
+            self.volume += self.rate / 60 * (now - self._since)
+            self.time += now - self._since
+        self._since = now
+
+    def apply(self, event, rate=None):
+        with self._lock:
+            self._close(self.clock())
+            if event == 'start':
+                self.running = True
+            elif event == 'stop':
+                self.running = False
+            elif event == 'setrate':
+                self.rate = float(rate)
+
+    def dispensed(self):
+        # 返回(累计体积 mL, 累计运行时间 s)
+        with self._lock:
+            if not self.running:
+                return self.volume, self.time
+            elapsed = self.clock() - self._since
+            return self.volume + self.rate / 60 * elapsed, self.time + elapsed
+
+
+# 泵控制基类，各型号只需给出命令格式、节拍与应答格式；缺少命令格式的型号在创建时即报错
+class Pump(abc.ABC):
+    model = None
+    pacing = 0.1 # 两条命令之间的最小间隔
+    ack = None # 应答格式，为空表示设备无应答
+    settle = 2.0 # 打开串口后设备复位所需时间
+
+    def __init__(self, port, clock=time.monotonic):
+        self.port = port
+        self.meter = VolumeMeter(clock)
+        self._rate = None # 最近一次设定的速度
+        self._rate_future = None
+        self.serial_port = SerialPort(port, pacing=self.pacing, ack=self.ack, settle=self.settle,
+                                      link=self.open_link(port))
+
+    def open_link(self, port):
+        return None
+
+    def _send_all(self, commands, urgent=False):
+        # 依次入队，返回最后一条命令的Future
+        future = None
+        for command in commands:
+            future = self.serial_port.send(command, urgent=urgent)
+        return future
+
+    @abc.abstractmethod
+    def setrate_commands(self, rate):
+        pass
+
+    @abc.abstractmethod
+    def start_commands(self):
+        pass
+
+    @abc.abstractmethod
+    def stop_commands(self):
+        pass
+
+    def _track(self, future, event, rate=None):
+        # 命令完成（发出或得到应答）时记入体积计量
+        def done(f):
+            if not f.cancelled() and f.exception() is None:
+                self.meter.apply(event, rate)
+        future.add_done_callback(done)
+        return future
+
+    def setrate(self, rate):
+        self._rate = rate
+        self._rate_future = self._track(self._send_all(self.setrate_commands(rate)), 'setrate', rate)
+        return self._rate_future
 
     def start(self):
-        if self.model == 'QHZS':
-            self.serial_port.send('Q6H2D')
-        elif self.model == 'Harvard':
-            self.serial_port.send('RUN')
-        elif self.model == 'Arduino':
-            self.serial_port.send('RUN')
+        return self._track(self._send_all(self.start_commands()), 'start')
 
     def stop(self):
-        if self.model == 'QHZS':
-            self.serial_port.send('Q6H6D')
-        elif self.model == 'Harvard':
-            self.serial_port.send('STP')
-        elif self.model == 'Arduino':
-            self.serial_port.send('STOP')
+        # 停止命令不排在改速等命令之后；被清除的改速命令在停止后补发，排队中的启动命令则不再执行
+        rate_pending = self._rate_future is not None and not self._rate_future.done()
+        future = self._track(self._send_all(self.stop_commands(), urgent=True), 'stop')
+        if rate_pending:
+            self.setrate(self._rate)
+        return future
+
+    def dispensed(self):
+        return self.meter.dispensed()
 
     def release(self):
         self.stop()
-        self.serial_port.close()
\ No newline at end of file
+        self.serial_port.close()
+
+
+@register_pump('QHZS')
+class QHZSPump(Pump):
+    def setrate_commands(self, rate):
+        rate_lst = rate.split('.')
+        return [f'Q1H{rate_lst[0]}D', f'Q2H{rate_lst[1]}D', 'Q6H1D']
+
+    def start_commands(self):
+        return ['Q6H2D']
+
+    def stop_commands(self):
+        return ['Q6H6D']
+
+
+@register_pump('Harvard')
+class HarvardPump(Pump):
+    pacing = 0.02
+    ack = rb'[:<>*]'
+
+    def setrate_commands(self, rate):
+        return [f'MLM {float(rate)}']
+
+    def start_commands(self):
+        return ['RUN']
+
+    def stop_commands(self):
+        return ['STP']
+
+
+@register_pump('Arduino')
+class ArduinoPump(Pump):
+    def setrate_commands(self, rate):
+        rate_lst = rate.split('.')
+        if len(rate_lst[0]) == 1:  # 如果整数部分只有1位
+            rate_str = '0' + rate_lst[0] + rate_lst[1].ljust(2, '0')
+        else:
+            rate_str = rate_lst[0] + rate_lst[1].ljust(2, '0')
+        return [f'SETRATE {rate_str}']
+
+    def start_commands(self):
+        return ['RUN']
+
+    def stop_commands(self):
+        return ['STOP']
+
+
+# 模拟设备：按Arduino协议解析命令，模拟命令延迟、滴加速度及累计体积，每条命令应答OK
+class SimulatedDevice:
+    def __init__(self, latency=0.005):
+        self.latency = latency # 设备处理一条命令的延迟
+        self.rate = 0.0 # mL/min
+        self.running = False
+        self.volume = 0.0 # 累计滴加体积 mL
+        self.commands = 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._buffer = b''
+
+    def _integrate(self, now):
+        if self.running:
+            self.volume += self.rate / 60 * (now - self._last)
+        self._last = now
+
+    def dispensed(self):
+        with self._lock:
+            self._integrate(time.monotonic())
+            return self.volume
+
+    def receive(self, data):
+        # 返回对完整命令行的应答
+        self._buffer += data
+        replies = b''
+        while b'\n' in self._buffer:
+            line, self._buffer = self._buffer.split(b'\n', 1)
+            if self.latency:
+                time.sleep(self.latency)
+            replies += self._execute(line.decode().strip())
+        return replies
+
+    def _execute(self, command):
+        with self._lock:
+            self._integrate(time.monotonic())
+            self.commands += 1
+            if command.startswith('SETRATE '):
+                digits = command.split(' ', 1)[1]
+                self.rate = int(digits) / 100
+            elif command == 'RUN':
+                self.running = True
+            elif command == 'STOP':
+                self.running = False
+            else:
+                return b'ERR\n'
+        return b'OK\n'
+
+
+# 进程内的虚拟串口，写入的数据交给模拟设备，设备应答放入读缓冲
+class VirtualSerial:
+    def __init__(self, device, timeout=0.05):
+        self.device = device
+        self.timeout = timeout
+        self._rx = bytearray()
+        self._cond = threading.Condition()
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def write(self, data):
+        reply = self.device.receive(data)
+        with self._cond:
+            self._rx += reply
+            self._cond.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        with self._cond:
+            if not self._rx:
+                self._cond.wait(self.timeout)
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._rx.clear()
+
+    def close(self):
+        pass
+
+
+@register_pump('Simulated')
+class SimulatedPump(ArduinoPump):
+    # 无需硬件的模拟泵，用于测试及压力测试整个控制循环
+    pacing = 0.0
+    ack = rb'OK|ERR'
+    settle = 0.0
+    latency = 0.005
+
+    def open_link(self, port):
+        self.device = SimulatedDevice(self.latency)
+        return VirtualSerial(self.device)
@@ -0,0 +1,118 @@
+# 化学笺集自动化滴定项目的一部分，用于记录及读取逐帧滴定数据
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import os
+import re
+import json
+import time
+import queue
+import threading
+import numpy as np
+
+def frame_dtype(zones):
+    # 每帧一条记录，zones为取样区域数K
+    return np.dtype([('seq', np.int64),
+                     ('t', np.float64), # 采集时间（单调时钟）
+                     ('zone_mean', np.float32, (zones, 3)),
+                     ('zone_diff', np.float32, (zones, 3)),
+                     ('changed', np.bool_),
+                     ('homo', np.bool_),
+                     ('endpoint', np.bool_),
+                     ('confirmed', np.bool_),
+                     ('pump_on', np.bool_),
+                     ('volume', np.float64)])
+
+class RunRecorder:
+
+    def __init__(self, record_dir, zones, meta=None, chunk_size=256, station=''):
+        # 每次滴定一个目录：meta.json记录参数与数据类型，frames.bin按块追加定长记录
+        self.path = self._make_run_dir(record_dir, station)
+        self.dtype = frame_dtype(zones)
+        self.chunk_size = chunk_size
+        self.buffer = np.zeros(chunk_size, dtype=self.dtype)
+        self.count = 0 # 当前块已写入的条数
+        self.total = 0
+        self.mp = None
+
+        header = {'zones': zones,
+                  'descr': np.lib.format.dtype_to_descr(self.dtype),
+                  'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())}
+        header.update(meta or {})
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(header, f, indent=4, default=str)
+
+        self.file = open(os.path.join(self.path, 'frames.bin'), 'ab')
+        self.queue = queue.Queue()
+        self._writer_thread = threading.Thread(target=self._run_writer)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    @staticmethod
+    def _make_run_dir(record_dir, station):
+        # 目录名为时间加工位名，多个工位共用记录目录或同一秒内多次滴定时追加序号，不覆盖已有记录
+        name = time.strftime('%Y%m%d-%H%M%S', time.localtime())
+        station = re.sub(r'[\\/:*?"<>|\s]+', '_', station).strip('._')
+        if station:
+            name = f'{name}-{station}'
+        path = os.path.join(record_dir, name)
+        n = 1
+        while True:
+            try:
+                os.makedirs(path)
+                return path
+            except FileExistsError:
+                n += 1
+                path = os.path.join(record_dir, f'{name}-{n}')
+
+    def append(self, seq, t, zone_mean, zone_diff, changed, homo, endpoint, confirmed, pump_on, volume):
+        row = self.buffer[self.count]
+        row['seq'] = seq
+        row['t'] = t
+        row['zone_mean'] = zone_mean
+        row['zone_diff'] = zone_diff
+        row['changed'] = changed
+        row['homo'] = homo
+        row['endpoint'] = endpoint
+        row['confirmed'] = confirmed
+        row['pump_on'] = pump_on
+        row['volume'] = volume
+        self.count += 1
+        self.total += 1
+        if self.count == self.chunk_size:
+            self._flush_chunk()
+
+    def _flush_chunk(self):
+        # 写满的块交给后台线程落盘，检测线程换用新的缓冲区
+        if self.count:
+            self.queue.put(self.buffer[:self.count])
+            self.buffer = np.zeros(self.chunk_size, dtype=self.dtype)
+            self.count = 0
+
+    def _run_writer(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            try:
+                chunk.tofile(self.file)
+                self.file.flush()
+            except Exception as e:
+                if self.mp:
+                    self.mp.log('we', f'{e}')
+
+    def close(self):
+        self._flush_chunk()
+        self.queue.put(None)
+        self._writer_thread.join()
+        self.file.close()
+
+def load_run(path):
+    # 读取一次滴定记录，返回(参数, 内存映射的结构化数组)
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    dtype = np.lib.format.descr_to_dtype(meta['descr'])
+    frames_file = os.path.join(path, 'frames.bin')
+    if os.path.getsize(frames_file) < dtype.itemsize:
+        return meta, np.zeros(0, dtype=dtype)
+    return meta, np.memmap(frames_file, dtype=dtype, mode='r')
@@ -0,0 +1,227 @@
+# 化学笺集自动化滴定项目的一部分，用于离线回放录像并复现终点判定
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import time
+import argparse
+import numpy as np
+import cap_process
+import pump_control
+import titration
+import message_process
+from color_metric import hex_to_hsv
+
+# 回放用的空泵，只记录状态，体积按回放时钟计量
+class NullPump:
+    def __init__(self, clock):
+        self.rate=None
+        self.running=False
+        self.meter=pump_control.VolumeMeter(clock)
+
+    def setrate(self, rate):
+        self.rate=rate
+        self.meter.apply('setrate', rate)
+
+    def start(self):
+        self.running=True
+        self.meter.apply('start')
+
+    def stop(self):
+        self.running=False
+        self.meter.apply('stop')
+
+    def release(self):
+        self.stop()
+
+    def dispensed(self):
+        return self.meter.dispensed()
+
+# 预先归约好的区域均值序列，与Cap接口一致，每帧只提供时间戳
+class ZoneCap:
+    def __init__(self, reduced):
+        self.t=reduced['t']
+        self.frame=None
+        self.seq=0
+        self.timestamp=0.0
+
+    def wait_frame(self, last_seq=0, timeout=None):
+        if self.seq>=len(self.t):
+            raise Exception('CapEndOfStream')
+        self.timestamp=float(self.t[self.seq])
+        self.seq+=1
+        return self.seq,self.timestamp,None
+
+    def close_cap(self):
+        pass
+
+# 直接返回预先计算的区域均值，不再处理图像
+class ZoneProcessor(cap_process.HSVProcessor):
+    def __init__(self, reduced):
+        super().__init__()
+        self.zone_data=reduced['zone_mean']
+        self.zone_grid=tuple(int(v) for v in reduced['zone_grid'])
+        self.sample_roi=tuple(int(v) for v in reduced['roi'])
+
+    def get_zone_stats(self):
+        zone_mean=self.zone_data[self.frame_seq-1]
+        self.zone_mean=zone_mean
+        self.left_avg, self.middle_avg, self.right_avg = self.split_lmr(zone_mean)
+        return zone_mean, zone_mean, np.zeros_like(zone_mean)
+
+    def analyze(self):
+        if self.analysis is not None and self.analysis.seq==self.frame_seq:
+            return self.analysis
+        analysis=cap_process.FrameAnalysis(self.frame_seq, self.frame_ts)
+        analysis.zone_mean,_,_=self.get_zone_stats()
+        analysis.left_avg, analysis.middle_avg, analysis.right_avg = self.left_avg, self.middle_avg, self.right_avg
+        self.analysis=analysis
+        return analysis
+
+    def show_frame_window(self):
+        return None
+
+def _new_titration(cap, proc, rate, threshold, threshold_times, v_times, confirm_time, zone_weights, log_file,
+                   pump_model=None, adaptive_dosing=False, confirm_confidence=0, sigma_threshold=None,
+                   color_metric='hsv', target_color=None, target_fraction=0.5):
+    t=titration.Titration(rate=rate, threshold=threshold, threshold_times=threshold_times)
+    t.mp=message_process.MessageProcessor(log_file=log_file, quiet=True)
+    t.usemask=proc.usemask
+    t.zone_grid=list(proc.zone_grid)
+    t.v_times=v_times
+    t.zone_weights=zone_weights
+    t.confirm_time=confirm_time
+    t.confirm_confidence=confirm_confidence
+    t.sigma_threshold=sigma_threshold
+    t.color_metric=color_metric
+    if target_color:
+        # 以给定的终点颜色代替大模型预测
+        t.predict_color=target_color
+        t.predict_hsv=hex_to_hsv(target_color)
+        t.use_prediction=True
+    t.target_fraction=target_fraction
+    t.adaptive_dosing=adaptive_dosing
+    t.record_dir=''
+    t.autopreview=False
+    t.cap=cap
+    t.clock=lambda: t.cap.timestamp
+    # 指定pump_model（如Simulated）时经完整的泵命令链路回放，用于压力测试
+    t.pump=pump_control.create_pump('', pump_model, t.clock) if pump_model else NullPump(t.clock)
+    t.pump.setrate(rate)
+
+    t.cd=titration.ColorDetect(threshold, threshold_times, v_times=v_times, zone_weights=zone_weights,
+                               sigma_threshold=sigma_threshold, adapt_time=t.adapt_time, min_std=t.min_std,
+                               metric=color_metric)
+    t.cd.mp=t.mp
+    t.cd.proc=proc
+    proc.mp=t.mp
+    return t
+
+def _run_replay(t):
+    started=time.perf_counter()
+    t.running=True
+    t._run_titration()
+    t.cap.close_cap()
+    t.mp.flush()
+
+    return {'endpoint': t.endpoint_seq is not None,
+            'frame': t.endpoint_seq,
+            'time': t.endpoint_time,
+            'volume': t.endpoint_volume,
+            'confirm': t.endpoint_confirm,
+            'dispensed': t.pump.dispensed()[0], # 回放结束时的累计滴加体积
+            'frames': t.cap.seq,
+            'elapsed': time.perf_counter()-started}
+
+def _new_processor(roi, usemask, hsv_lower, hsv_upper, zone_grid, white_roi=None):
+    proc=cap_process.HSVProcessor()
+    proc.usemask=usemask
+    proc.white_roi=tuple(int(v) for v in white_roi) if white_roi else None
+    proc.zone_grid=tuple(zone_grid)
+    proc.sample_roi=tuple(int(v) for v in roi)
+    if hsv_lower is not None:
+        proc.hsv_lower=np.array(hsv_lower)
+    if hsv_upper is not None:
+        proc.hsv_upper=np.array(hsv_upper)
+    return proc
+
+def replay(source, roi, rate='06.00', threshold=13, threshold_times=1, usemask=False,
+           hsv_lower=None, hsv_upper=None, zone_grid=(1, 3), fps=None, log_file=None,
+           v_times=3, confirm_time=15, zone_weights=None, pump_model=None, adaptive_dosing=False,
+           confirm_confidence=0, sigma_threshold=None, white_roi=None, color_metric='hsv',
+           target_color=None, target_fraction=0.5):
+    # 以完整的ColorDetect/Titration逻辑回放录像，时钟由帧时间戳驱动，返回终点帧、时间与体积
+    proc=_new_processor(roi, usemask, hsv_lower, hsv_upper, zone_grid, white_roi)
+    t=_new_titration(cap_process.VideoCap(source, fps), proc, rate, threshold, threshold_times,
+                     v_times, confirm_time, zone_weights, log_file, pump_model, adaptive_dosing,
+                     confirm_confidence, sigma_threshold, color_metric, target_color, target_fraction)
+    return _run_replay(t)
+
+def reduce_source(source, roi, usemask=False, hsv_lower=None, hsv_upper=None, zone_grid=(1, 3), fps=None):
+    # 解码录像并归约为逐帧区域均值，供多组参数反复回放
+    cap=cap_process.VideoCap(source, fps)
+    proc=_new_processor(roi, usemask, hsv_lower, hsv_upper, zone_grid)
+    t=[]
+    zone_mean=[]
+    try:
+        while True:
+            seq,ts,frame=cap.wait_frame()
+            proc.set_frame(frame, seq, ts)
+            t.append(ts)
+            zone_mean.append(proc.get_zone_stats()[0])
+    except Exception as e:
+        if str(e)!='CapEndOfStream':
+            raise
+    finally:
+        cap.close_cap()
+
+    return {'t': np.array(t, dtype=np.float64),
+            'zone_mean': np.array(zone_mean, dtype=np.float64).reshape(len(t), -1, 3),
+            'zone_grid': np.array(zone_grid),
+            'roi': np.array(roi)}
+
+def replay_zones(reduced, rate='06.00', threshold=13, threshold_times=1, v_times=3,
+                 confirm_time=15, zone_weights=None, usemask=False, confirm_confidence=0, sigma_threshold=None,
+                 adaptive_dosing=False, log_file=None):
+    # 在归约后的区域均值上回放，判定逻辑与replay相同但不再处理图像
+    proc=ZoneProcessor(reduced)
+    proc.usemask=usemask
+    t=_new_titration(ZoneCap(reduced), proc, rate, threshold, threshold_times,
+                     v_times, confirm_time, zone_weights, log_file, adaptive_dosing=adaptive_dosing,
+                     confirm_confidence=confirm_confidence, sigma_threshold=sigma_threshold)
+    return _run_replay(t)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='离线回放滴定录像并报告终点')
+    parser.add_argument('source', help='视频文件、图片目录或通配符')
+    parser.add_argument('--roi', type=int, nargs=4, required=True, metavar=('X', 'Y', 'W', 'H'))
+    parser.add_argument('--rate', default='06.00')
+    parser.add_argument('--threshold', type=float, default=13)
+    parser.add_argument('--threshold-times', type=float, default=1)
+    parser.add_argument('--usemask', action='store_true')
+    parser.add_argument('--hsv-lower', type=int, nargs=3)
+    parser.add_argument('--hsv-upper', type=int, nargs=3)
+    parser.add_argument('--zone-grid', type=int, nargs=2, default=[1, 3], metavar=('ROWS', 'COLS'))
+    parser.add_argument('--fps', type=float)
+    parser.add_argument('--v-times', type=float, default=3)
+    parser.add_argument('--confirm-time', type=float, default=15)
+    parser.add_argument('--confidence', type=float, default=0, help='提前确认终点的置信度，0为只用固定窗口')
+    parser.add_argument('--pump', help='经指定型号的泵驱动回放，如Simulated')
+    parser.add_argument('--adaptive', action='store_true', help='启用自适应滴加')
+    parser.add_argument('--sigma', type=float, help='启用自适应参考颜色，阈值为背景标准差的倍数')
+    parser.add_argument('--metric', choices=['hsv', 'lab'], default='hsv', help='颜色差异：hsv（环形色相）或lab（ΔE2000）')
+    parser.add_argument('--target-color', help='终点颜色如#FF66CC，按接近该颜色的进度判定')
+    parser.add_argument('--target-fraction', type=float, default=0.5)
+    parser.add_argument('--white-roi', type=int, nargs=4, metavar=('X', 'Y', 'W', 'H'), help='白色参考块，用于光照补偿')
+    args=parser.parse_args()
+
+    result=replay(args.source, args.roi, args.rate, args.threshold, args.threshold_times, args.usemask,
+                  args.hsv_lower, args.hsv_upper, args.zone_grid, args.fps,
+                  v_times=args.v_times, confirm_time=args.confirm_time, pump_model=args.pump,
+                  adaptive_dosing=args.adaptive, confirm_confidence=args.confidence,
+                  sigma_threshold=args.sigma, white_roi=args.white_roi, color_metric=args.metric,
+                  target_color=args.target_color, target_fraction=args.target_fraction)
+    if result['endpoint']:
+        print(f"终点：第{result['frame']}帧 {result['time']:.2f} s {result['volume']:.2f} mL，确认用时{result['confirm']:.2f} s")
+    else:
+        print('未到达终点')
+    print(f"处理{result['frames']}帧，用时{result['elapsed']:.2f} s")
@@ -0,0 +1,142 @@
+# 化学笺集自动化滴定项目的一部分，用于在一个进程中管理多个滴定工位
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import os
+import json
+import time
+import titration
+import message_process
+import stream_process
+import analysis_process
+import batch_process
+
+class Station:
+    # 一个工位：独立的摄像头、泵、ROI、配置文件和日志，以及各自的视频流和状态推送
+
+    def __init__(self,name='',config_file='config.json',log_file='cat.log'):
+        self.name=name
+        self.config_file=config_file
+        self.log_file=log_file
+        self.t=titration.Titration()
+        self.t.station_name=name
+        self.t.mp=message_process.MessageProcessor(log_file)
+        self.streamer=stream_process.MJPEGStreamer(self._preview_source)
+        self.streamer.mp=self.t.mp
+        self.status=stream_process.StatusBroadcaster(self.status_snapshot)
+        self.status.mp=self.t.mp
+        self.batch=batch_process.BatchScheduler(self.t)
+        self.load_config()
+
+    def load_config(self):
+        if os.path.exists(self.config_file):
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+                # 将配置应用到滴定实例
+                for key, value in config.items():
+                    if hasattr(self.t, key):
+                        setattr(self.t, key, value)
+
+    def save_config(self, config_data):
+        # 先读取现有配置
+        existing_config = {}
+        if os.path.exists(self.config_file):
+            with open(self.config_file, 'r') as f:
+                existing_config = json.load(f)
+
+        # 合并配置
+        merged_config = {**existing_config,** config_data}
+
+        # 保存合并后的配置
+        with open(self.config_file, 'w') as f:
+            json.dump(merged_config, f, indent=4)
+
+        # 更新滴定实例的配置
+        for key, value in config_data.items():
+            if hasattr(self.t, key):
+                setattr(self.t, key, value)
+
+        self.t.mp.log('gc',f'{merged_config}')
+
+    def _preview_source(self, last_key, timeout):
+        # 为视频流编码线程提供预览帧，帧标识为(处理器, 预览序号)
+        if (hasattr(self.t, 'cd') and self.t.cd and
+            hasattr(self.t.cd, 'proc') and self.t.cd.proc):
+            proc = self.t.cd.proc
+            last_seq = last_key[1] if last_key and last_key[0] is proc else -1
+            seq, frame = proc.wait_preview(last_seq, timeout)
+            if frame is not None:
+                return (proc, seq), frame
+        time.sleep(timeout)
+        return None, None
+
+    def status_snapshot(self):
+        return {
+            'station': self.name,
+            'message': getattr(self.t.mp, 'message', ''),
+            'predict_color': getattr(self.t, 'predict_color', '#9CA3AF'),
+            'time': f"{getattr(self.t, 'time', 0):.2f} s" if getattr(self.t, 'time', 0) > 0 else '--',
+            'volume': f"{getattr(self.t, 'volume', 0):.2f} mL",
+            'running': getattr(self.t, 'running', False),
+            'endpoint': getattr(self.t, 'endpoint', False),
+            'progress': self.t.cd.progress if getattr(self.t, 'cd', None) and self.t.cd.start_chroma is not None else None,
+            'batch': self.batch.progress()
+        }
+
+    def con(self):
+        self.t.con()
+
+    def release(self):
+        self.t.release()
+
+class StationManager:
+    # 管理多个工位，各工位的采集、泵通信和滴定循环运行在各自的线程中，互不阻塞；
+    # HSV分析提交到共享的有界分析池，总并发量不超过CPU核数；analysis为process时在工作进程中分析
+
+    def __init__(self,workers=None,port=8917,analysis='thread'):
+        self.port=port
+        self.workers=workers or os.cpu_count() or 1
+        self.analysis_pool=analysis_process.create_analysis_pool(analysis,self.workers)
+        self.stations=[]
+
+    def add(self,name='',config_file='config.json',log_file=None):
+        if log_file is None:
+            # 第一个工位沿用cat.log，其余工位按名称区分日志
+            log_file='cat.log' if not self.stations else f'cat_{name or len(self.stations)}.log'
+        station=Station(name or f'工位{len(self.stations)+1}',config_file,log_file)
+        station.t.analysis_pool=self.analysis_pool
+        self.stations.append(station)
+        return station
+
+    @classmethod
+    def from_file(cls,path='stations.json'):
+        # stations.json格式：
+        # {"port": 8917, "workers": 4, "analysis": "thread",
+        #  "stations": [{"name": "1号", "config": "config.json"},
+        #               {"name": "2号", "config": "config_2.json", "log_file": "cat_2.log"}]}
+        # 文件不存在时只有一个使用config.json的工位
+        if not os.path.exists(path):
+            manager=cls()
+            manager.add()
+            return manager
+        with open(path, 'r', encoding='utf-8') as f:
+            setting = json.load(f)
+        manager=cls(setting.get('workers'),setting.get('port',8917),setting.get('analysis','thread'))
+        for item in setting.get('stations',[]):
+            manager.add(item.get('name',''),item.get('config','config.json'),item.get('log_file'))
+        if not manager.stations:
+            raise Exception('NoStationConfigured')
+        return manager
+
+    def con(self):
+        # 各工位在各自线程中连接硬件，慢速的摄像头或串口不会拖慢其他工位
+        for station in self.stations:
+            station.con()
+
+    def release(self):
+        for station in self.stations:
+            try:
+                station.release()
+            except Exception as e:
+                station.t.mp.log('le',f'{e}')
+        self.analysis_pool.shutdown()
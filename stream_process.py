@@ -0,0 +1,170 @@
+# 化学笺集自动化滴定项目的一部分，用于向网页推送视频流及状态
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import cv2
+import json
+import time
+import threading
+import numpy as np
+
+class MJPEGStreamer:
+
+    # 可选的视频流规格：名称 -> ((宽, 高), JPEG质量)
+    profiles={'low':((320,240),40),
+              'normal':((640,480),50),
+              'high':((1280,960),80)}
+
+    def __init__(self,source):
+        # source(last_key, timeout)返回(帧标识, 帧)，无可用帧时帧为None
+        self.source=source
+        self.mp=None
+        self.cond=threading.Condition()
+        self.version=0 # 每发布一次新编码结果加一
+        self.jpegs={} # 规格 -> 当前帧的JPEG数据
+        self.subscribers={name:0 for name in self.profiles}
+        self._encoder_thread=None
+
+    def start(self):
+        if self._encoder_thread is None:
+            self._encoder_thread = threading.Thread(target=self._run_encoder)
+            self._encoder_thread.daemon = True
+            self._encoder_thread.start()
+
+    def _encode(self,frame,name):
+        size,quality=self.profiles[name]
+        if (frame.shape[1],frame.shape[0])!=size:
+            frame=cv2.resize(frame,size,interpolation=cv2.INTER_AREA)
+        ret,buffer=cv2.imencode('.jpg',frame,[cv2.IMWRITE_JPEG_QUALITY,quality])
+        if not ret:
+            raise Exception('JPEGEncodeError')
+        return buffer.tobytes()
+
+    def _publish(self,frame,names,replace=True):
+        jpegs={name:self._encode(frame,name) for name in names}
+        with self.cond:
+            if replace:
+                self.jpegs=jpegs
+            else:
+                self.jpegs.update(jpegs)
+            self.version+=1
+            self.cond.notify_all()
+
+    def _run_encoder(self):
+        # 编码线程：每个新预览帧每种规格只编码一次，再分发给所有客户端
+        last_key=None
+        frame=None
+        blank_frame=np.zeros((480,640,3),dtype=np.uint8)
+        while True:
+            try:
+                key,new_frame=self.source(last_key,0.5)
+                if new_frame is None:
+                    # 尚无预览帧时发送黑色占位帧
+                    key,new_frame=None,blank_frame
+
+                with self.cond:
+                    wanted=[name for name,count in self.subscribers.items() if count>0]
+                    missing=[name for name in wanted if name not in self.jpegs]
+
+                if frame is None or key!=last_key:
+                    frame=new_frame
+                    last_key=key
+                    self._publish(frame,wanted)
+                elif missing:
+                    # 新客户端请求了当前未编码的规格
+                    self._publish(frame,missing,replace=False)
+
+            except Exception as e:
+                if self.mp:
+                    self.mp.log('ve',f'{e}')
+                error_frame=np.zeros((480,640,3),dtype=np.uint8)
+                cv2.putText(error_frame,'Camera Error',(200,240),
+                            cv2.FONT_HERSHEY_SIMPLEX,1,(255,255,255),2)
+                try:
+                    with self.cond:
+                        wanted=[name for name,count in self.subscribers.items() if count>0]
+                    self._publish(error_frame,wanted)
+                except Exception:
+                    pass
+                frame=None
+                time.sleep(1)
+
+    def stream(self,name='normal'):
+        # 单个客户端的multipart生成器，只取最新帧，慢速客户端自动丢帧
+        if name not in self.profiles:
+            name='normal'
+        self.start()
+        with self.cond:
+            self.subscribers[name]+=1
+            self.cond.notify_all()
+        try:
+            version=-1
+            while True:
+                with self.cond:
+                    while self.version==version or name not in self.jpegs:
+                        self.cond.wait(1.0)
+                    version=self.version
+                    frame_bytes=self.jpegs[name]
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        finally:
+            with self.cond:
+                self.subscribers[name]-=1
+
+class StatusBroadcaster:
+
+    def __init__(self,snapshot,interval=0.1,keepalive=15):
+        # snapshot()返回当前状态字典；interval为推送的最小间隔（合并期间的多次变化）
+        self.snapshot=snapshot
+        self.interval=interval
+        self.keepalive=keepalive
+        self.mp=None
+        self.cond=threading.Condition()
+        self.version=0
+        self.status={}
+        self._publisher_thread=None
+
+    def start(self):
+        if self._publisher_thread is None:
+            self._publisher_thread = threading.Thread(target=self._run_publisher)
+            self._publisher_thread.daemon = True
+            self._publisher_thread.start()
+
+    def _run_publisher(self):
+        # 按最大频率采样状态，只有发生变化时才唤醒客户端
+        while True:
+            try:
+                status=self.snapshot()
+                if status!=self.status:
+                    with self.cond:
+                        self.status=status
+                        self.version+=1
+                        self.cond.notify_all()
+            except Exception as e:
+                if self.mp:
+                    self.mp.log('ve',f'{e}')
+            time.sleep(self.interval)
+
+    def stream(self):
+        # 单个客户端的SSE生成器，首次发送完整状态，此后只发送变化的字段
+        self.start()
+        sent={}
+        version=0
+        while True:
+            with self.cond:
+                if self.version==version:
+                    self.cond.wait(self.keepalive)
+                if self.version==version:
+                    status=None
+                else:
+                    version=self.version
+                    status=self.status
+
+            if status is None:
+                yield ': keepalive\n\n'
+                continue
+
+            delta={key:value for key,value in status.items() if sent.get(key,object())!=value}
+            if delta:
+                sent=dict(status)
+                yield f'data: {json.dumps(delta,ensure_ascii=False)}\n\n'
@@ -0,0 +1,80 @@
+# 化学笺集自动化滴定项目的一部分，用于回归测试：取样区域裁剪后的HSV统计与整帧处理结果一致
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import os
+import sys
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cap_process
+import color_metric
+
+ROI = (37, 21, 151, 97) # 宽度不能被3整除，覆盖截断的情况
+
+def _frames():
+    # 固定种子的合成帧：随机噪声；跨越红色（179与0之间）的色相渐变并带有黑色像素；大面积近灰色
+    rng = np.random.default_rng(2026)
+    noise = rng.integers(0, 256, (180, 240, 3), dtype=np.uint8)
+
+    hsv = np.zeros((180, 240, 3), dtype=np.uint8)
+    hsv[:, :, 0] = (np.arange(240)[None, :] * 0.4 + 160) % 180
+    hsv[:, :, 1] = np.linspace(0, 255, 180, dtype=np.uint8)[:, None]
+    hsv[:, :, 2] = 200
+    gradient = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+    gradient[::7, ::5] = 0
+
+    grey = np.clip(200 + rng.normal(0, 2, (180, 240, 3)), 0, 255).astype(np.uint8)
+    grey[60:120, 100:160] = (180, 150, 240)
+    return [noise, gradient, grey]
+
+def _full_frame_parts(frame, roi, usemask, lower, upper):
+    # 原实现：整帧转换HSV，启用掩膜时整帧inRange/bitwise_and后再转换，切出左、中、右三部分，
+    # 只保留非黑色像素；未启用掩膜时直接使用整帧HSV（不再对HSV数据做二次转换）
+    hsv_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    if usemask:
+        mask = cv2.inRange(hsv_frame, lower, upper)
+        masked_frame = cv2.bitwise_and(frame, frame, mask=mask)
+        hsv_frame = cv2.cvtColor(masked_frame, cv2.COLOR_BGR2HSV)
+    x, y, w, h = roi
+    part_width = w // 3
+    parts = []
+    for i in range(3):
+        part = hsv_frame[y:y + h, x + i * part_width:x + (i + 1) * part_width].reshape(-1, 3)
+        parts.append(part[np.any(part != 0, axis=-1)].astype(np.float64))
+    return parts
+
+def _expected(pixels):
+    # 饱和度、明度为算术均值，色相为按饱和度加权的环形均值
+    if len(pixels) == 0:
+        return np.zeros(3)
+    mean = pixels.mean(axis=0)
+    mean[0] = color_metric.circular_hue_mean(pixels[:, 0], weights=pixels[:, 1])
+    return mean
+
+@pytest.mark.parametrize('frame_index', range(3))
+@pytest.mark.parametrize('usemask,lower,upper', [
+    (False, (0, 0, 0), (179, 255, 255)),
+    (True, (0, 30, 40), (179, 255, 255)),
+    (True, (20, 0, 0), (140, 200, 230)),
+])
+def test_roi_path_matches_full_frame(frame_index, usemask, lower, upper):
+    frame = _frames()[frame_index]
+    proc = cap_process.HSVProcessor()
+    proc.sample_roi = ROI
+    proc.usemask = usemask
+    proc.hsv_lower = np.array(lower)
+    proc.hsv_upper = np.array(upper)
+    proc.set_frame(frame, 1, 0.0)
+
+    actual = proc.get_hsv_values()
+    parts = _full_frame_parts(frame, ROI, usemask, np.array(lower), np.array(upper))
+
+    np.testing.assert_array_equal(proc.zone_count, [len(p) for p in parts])
+    for pixels, value in zip(parts, actual):
+        expected = _expected(pixels)
+        np.testing.assert_allclose(value[1:], expected[1:], atol=1e-6)
+        if len(pixels) and pixels[:, 1].sum() > 0:
+            assert color_metric.hue_distance(value[0], expected[0]) < 1e-6
@@ -0,0 +1,57 @@
+# 化学笺集自动化滴定项目的一部分，用于回归测试：在合成的区域均值序列上回放终点判定
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import replay_process
+
+BASE = np.array([30.0, 20.0, 150.0])
+PINK = np.array([165.0, 120.0, 150.0])
+
+def _zones(weight, sigma=0.3, fps=30, seed=0):
+    # weight为每帧由初始颜色变为终点颜色的比例，三个区域颜色相同并各自叠加噪声
+    rng = np.random.default_rng(seed)
+    t = np.arange(len(weight)) / fps
+    zone_mean = BASE + np.asarray(weight)[:, None] * (PINK - BASE)
+    zone_mean = np.repeat(zone_mean[:, None, :], 3, axis=1) + rng.normal(0, sigma, (len(t), 3, 3))
+    return {'t': t, 'zone_mean': zone_mean, 'zone_grid': np.array([1, 3]), 'roi': np.array([0, 0, 90, 30])}
+
+def _flash(hold, onset=10.0, fade=2.0, total=40.0, fps=30):
+    # onset秒时变色，保持hold秒后在fade秒内褪回初始颜色
+    t = np.arange(int(total * fps)) / fps
+    return np.clip(np.where(t < onset, 0, 1 - (t - onset - hold) / fade), 0, 1) * (t >= onset)
+
+def test_transient_flash_is_not_confirmed():
+    reduced = _zones(_flash(hold=5.0))
+    for confidence in (0, 0.99):
+        result = replay_process.replay_zones(reduced, confirm_time=15, confirm_confidence=confidence)
+        assert not result['endpoint'], confidence
+
+def test_persistent_change_is_confirmed_early():
+    reduced = _zones(_flash(hold=60.0))
+    result = replay_process.replay_zones(reduced, confirm_time=15, confirm_confidence=0.99)
+    assert result['endpoint']
+    assert 3.0 <= result['confirm'] < 15
+
+def test_adaptive_dosing_ignores_flat_noise():
+    # 无颜色变化时噪声不应触发减速或脉冲，60 s内应按设定速度滴加6 mL
+    for sigma in (1.0, 2.0):
+        result = replay_process.replay_zones(_zones(np.zeros(60 * 30 + 1), sigma=sigma), rate='06.00',
+                                             adaptive_dosing=True)
+        assert not result['endpoint']
+        assert abs(result['dispensed'] - 6.0) < 0.05, (sigma, result['dispensed'])
+
+def test_end_of_stream_is_not_an_error(tmp_path):
+    # 未到终点的回放读完录像时正常结束，日志中不应出现滴定错误
+    log_file = str(tmp_path / 'replay.log')
+    result = replay_process.replay_zones(_zones(np.zeros(100)), log_file=log_file)
+    assert not result['endpoint']
+    assert result['frames'] == 100
+    with open(log_file, 'r') as f:
+        log = f.read()
+    assert 'TITRATIONERROR' not in log and 'RELEASE' not in log
+    assert 'ENDOFSTREAM' in log
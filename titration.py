@@ -2,91 +2,242 @@
 # 作者：李峙德，刘一弘
 # 邮箱：contact@chemview.net
 # 最后更新：2025-10-25
-import cv2
 import collections
+import statistics
 import time
 import threading
 import numpy as np
 import cap_process
 import pump_control
 import ds_connect
+import indicator_table
+import record_process
+import color_metric
+
+# 自适应参考颜色：各区域各通道的在线背景模型，前期按Welford累计均值与方差，
+# 之后转为时间常数为adapt_time秒的指数加权，仅在颜色未变化时更新，用于跟随环境光漂移
+class ZoneBackground:
+
+    def __init__(self,initial,timestamp=None,adapt_time=120.0,min_std=1.0,hue=False):
+        self.mean=np.array(initial,dtype=np.float64)
+        self.hue=hue # 第一列为色相时按环形更新
+        self.var=np.zeros_like(self.mean)
+        self.count=1
+        self.last=timestamp
+        self.adapt_time=adapt_time
+        self.min_std=min_std # 标准差下限，避免画面静止时阈值趋于零
+
+    def std(self):
+        return np.maximum(np.sqrt(self.var),self.min_std)
+
+    def update(self,x,timestamp=None,zones=None):
+        # zones为(K,)布尔数组，只更新其中为真的区域
+        dt=timestamp-self.last if timestamp is not None and self.last is not None else 0.0
+        self.last=timestamp
+        self.count+=1
+        alpha=max(1.0/self.count,min(max(dt,0.0)/self.adapt_time,1.0))
+        delta=x-self.mean
+        if self.hue:
+            # 与hsv_distance一致，近无色时色相的随机变化不计入方差
+            delta[...,0]=color_metric.wrap_hue(delta[...,0])*color_metric.hue_weight(x[...,1],self.mean[...,1])
+        mean=self.mean+alpha*delta
+        if self.hue:
+            mean[...,0]%=color_metric.HUE_PERIOD
+        var=(1-alpha)*(self.var+alpha*delta*delta)
+        if zones is None:
+            self.mean,self.var=mean,var
+        else:
+            self.mean=np.where(zones[:,None],mean,self.mean)
+            self.var=np.where(zones[:,None],var,self.var)
 
 class ColorDetect:
 
-    def __init__(self,threshold,threshold_times,sequence_length=5):
+    def __init__(self,threshold,threshold_times,sequence_length=5,v_times=3,zone_weights=None,
+                 sigma_threshold=None,adapt_time=120.0,min_std=1.0,adapt_margin=0.5,metric='hsv',
+                 target_hsv=None,target_fraction=0.5,min_axis=10.0):
         self.proc=None
         self.initialized=False
         self.l_reference_hsv=None
         self.m_reference_hsv=None
         self.r_reference_hsv=None
+        self.reference_zones=None
+        self.zone_weights=None
+        self.zone_thresholds=None
+        self.zone_diff=None
+        self.zone_changed=None
+        self.zone_margin=0.0 # 差异与阈值之比的最大值
+        self.zone_delta_e=None # Lab模式下各区域的ΔE2000
+        self.metric=metric # hsv：各通道差异，色相按环形计算；lab：CIE ΔE2000
+        self.target_hsv=target_hsv # 预测的终点颜色，非空时按起始→目标方向上的进度判定
+        self.target_fraction=target_fraction # 进度达到该比例视为变色
+        self.min_axis=min_axis # 起始与目标颜色在色度平面上的最小距离，过近时不启用目标模式
+        self.reference_hsv_zones=None
+        self.start_chroma=None
+        self.target_chroma=None
+        self.zone_progress=None # 各区域的进度0~1
+        self.zone_start_distance=None
+        self.zone_target_distance=None
+        self.progress=0.0 # 中心区域的进度
         self.threshold=threshold
         self.threshold_times=threshold_times
+        self.v_times=v_times # V通道阈值倍数
+        self.custom_zone_weights=zone_weights # 自定义各区域阈值权重，为空时按threshold_times生成
+        self.sigma_threshold=sigma_threshold # 非空时启用自适应参考颜色，阈值以背景标准差的倍数表示
+        self.adapt_time=adapt_time
+        self.min_std=min_std
+        self.adapt_margin=adapt_margin # 差异低于阈值的该比例的区域才更新背景
+        self.background=None
+        self.base_thresholds=None # 以标准差为单位的阈值矩阵(K, 3)
         self.h_h=collections.deque(maxlen=sequence_length)
         self.s_h=collections.deque(maxlen=sequence_length)
         self.v_h=collections.deque(maxlen=sequence_length)
+        self.t_h=collections.deque(maxlen=sequence_length)
+        self.r_h=collections.deque(maxlen=sequence_length) # 中心区域差异与阈值之比
         self.l_current_hsv=None
         self.m_current_hsv=None
         self.r_current_hsv=None
         self.mp=None
 
+    def reset(self,threshold=None,metric=None):
+        # 更换样品后重新取参考颜色，保留已框选的取样区域；可同时更换阈值与判定方式（如指示剂推荐参数）
+        if threshold is not None:
+            self.threshold=threshold
+        if metric is not None:
+            self.metric=metric
+        self.initialized=False
+        self.reference_zones=None
+        self.background=None
+        self.start_chroma=None
+        self.target_chroma=None
+        self.zone_progress=None
+        self.progress=0.0
+        self.zone_diff=None
+        self.zone_changed=None
+        self.zone_margin=0.0
+        self.clear_history()
+
+    def clear_history(self):
+        # 清空中心区域的差异历史；差异比在HSV模式下为三列、目标与Lab模式下为一列，不能跨次滴定混用
+        for history in (self.h_h, self.s_h, self.v_h, self.t_h, self.r_h):
+            history.clear()
+
     def _initialize(self):
-        time.sleep(1)
-        self.proc.create_roi_mask()
-        self.l_reference_hsv,self.m_reference_hsv,self.r_reference_hsv=self.proc.get_hsv_values()
+        # 未预设取样区域时，等待画面稳定后由用户框选
+        if self.proc.sample_roi is None:
+            time.sleep(1)
+            self.proc.create_roi_mask()
+        self.proc.set_white_reference()
+        self.proc.lab=self.metric=='lab'
+        reference_hsv,_,_=self.proc.get_zone_stats()
+        self.reference_hsv_zones=reference_hsv.copy()
+        self.reference_zones=self.proc.zone_lab if self.proc.lab else reference_hsv
+        if self.sigma_threshold is not None:
+            self.background=ZoneBackground(self.reference_zones,self.proc.frame_ts,self.adapt_time,self.min_std,
+                                           hue=not self.proc.lab)
+        self.l_reference_hsv,self.m_reference_hsv,self.r_reference_hsv=self.proc.split_lmr(reference_hsv)
+        self._build_thresholds()
+        self._build_target()
         self.mp.log('il',self.l_reference_hsv)
         self.mp.log('im',self.m_reference_hsv)
         self.mp.log('ir',self.r_reference_hsv)
         self.initialized=True
 
+    def set_target(self,target_hsv):
+        # 设置或清除预测的终点颜色，已取参考颜色时立即生效
+        self.target_hsv=target_hsv
+        if self.initialized:
+            self._build_target()
+
+    def _build_target(self):
+        # 在色度平面上建立各区域起始颜色→目标颜色的方向
+        self.start_chroma=None
+        self.target_chroma=None
+        if self.target_hsv is None:
+            return
+        start=color_metric.hsv_chroma(self.reference_hsv_zones)
+        target=np.broadcast_to(color_metric.hsv_chroma(self.target_hsv),start.shape)
+        axis=float(np.linalg.norm(target-start,axis=-1).min())
+        if axis<self.min_axis:
+            # 目标与起始颜色几乎相同，无法判断方向，仍按颜色差异判定
+            self.mp.log('tn',f'{list(self.target_hsv)} {axis:.1f}')
+            return
+        self.start_chroma=start
+        self.target_chroma=target
+        self.mp.log('tg',f'{list(self.target_hsv)} {axis:.1f}')
+
+    def _build_thresholds(self):
+        # 各区域各通道的阈值矩阵(K, 3)
+        rows, cols = self.proc.zone_grid
+        if self.custom_zone_weights is not None:
+            self.zone_weights = np.asarray(self.custom_zone_weights, dtype=np.float64).reshape(rows * cols)
+        else:
+            # 中间一列权重更大，其余区域因环境影响阈值乘以threshold_times，权重较弱
+            zone_weights = np.full((rows, cols), float(self.threshold_times))
+            zone_weights[:, cols // 2] = 1.0
+            self.zone_weights = zone_weights.reshape(-1)
+        # V通道更敏感；ΔE2000本身已按感知均匀加权，Lab模式下三列使用同一阈值
+        if self.metric == 'lab':
+            channel_weights = np.ones(3)
+        else:
+            channel_weights = np.array([1.0, 1.0, float(self.v_times)])
+        unit = self.threshold if self.background is None else self.sigma_threshold
+        self.base_thresholds = float(unit) * self.zone_weights[:, None] * channel_weights[None, :]
+        self._update_thresholds()
+
+    def _update_thresholds(self):
+        # 自适应时阈值随背景标准差变化，Lab模式下取三个通道标准差的合成值
+        if self.background is None:
+            self.zone_thresholds = self.base_thresholds
+            return
+        std = self.background.std()
+        if self.metric == 'lab':
+            std = np.sqrt((std * std).sum(axis=1, keepdims=True))
+        self.zone_thresholds = self.base_thresholds * std
+
     def is_color_changed(self):
         if not self.initialized:
             self._initialize()
 
-        self.l_current_hsv, self.m_current_hsv, self.r_current_hsv = self.proc.get_hsv_values()
-
-        ## Middle ##
-        # 计算与参考颜色的差异
-        m_h_diff = abs(self.m_current_hsv[0] - self.m_reference_hsv[0])
-        m_s_diff = abs(self.m_current_hsv[1] - self.m_reference_hsv[1])
-        m_v_diff = abs(self.m_current_hsv[2] - self.m_reference_hsv[2])
-
-        # 存储历史值
+        analysis = self.proc.analyze()
+        self.l_current_hsv, self.m_current_hsv, self.r_current_hsv = analysis.left_avg, analysis.middle_avg, analysis.right_avg
+
+        # 计算各区域与参考颜色的差异，自适应时参考颜色为背景均值
+        if self.background is not None:
+            self.reference_zones = self.background.mean
+            self._update_thresholds()
+        if self.metric == 'lab':
+            current = analysis.zone_lab
+            # 差异记录为ΔE2000的色相、彩度、明度三项，判定使用合成的ΔE2000
+            self.zone_delta_e, diff = color_metric.delta_e2000(self.reference_zones, current, terms=True)
+            ratio = (self.zone_delta_e / self.zone_thresholds[:, 0])[:, None]
+        else:
+            current = analysis.zone_mean
+            diff = color_metric.hsv_distance(current, self.reference_zones)
+            ratio = diff / self.zone_thresholds
+        if self.start_chroma is not None:
+            # 目标颜色模式：计算各区域到起始、目标颜色的距离及沿该方向的进度，以进度代替差异判定
+            self.zone_progress, self.zone_start_distance, self.zone_target_distance = color_metric.target_progress(
+                color_metric.hsv_chroma(analysis.zone_mean), self.start_chroma, self.target_chroma)
+            self.progress = float(self.zone_progress[self.proc.center_zone()])
+            ratio = (self.zone_progress / (self.target_fraction * self.zone_weights))[:, None]
+        self.zone_diff = diff
+
+        # 存储中心区域历史值
+        m_h_diff, m_s_diff, m_v_diff = diff[self.proc.center_zone()]
         self.h_h.append(m_h_diff)
         self.s_h.append(m_s_diff)
         self.v_h.append(m_v_diff)
-        
-        # 权重更大
-        m_h_change = m_h_diff > self.threshold # 相较于后续的*self.threshold_times阈值*1倍数更小，因此权重更大
-        m_s_change = m_s_diff > self.threshold     
-        m_v_change = m_v_diff > self.threshold * 3 # V通道更敏感
-
-        ## Right ##
-        # 计算与参考颜色的差异
-        r_h_diff = abs(self.r_current_hsv[0] - self.r_reference_hsv[0])
-        r_s_diff = abs(self.r_current_hsv[1] - self.r_reference_hsv[1])
-        r_v_diff = abs(self.r_current_hsv[2] - self.r_reference_hsv[2])
-        
-        # 因环境影响，权重较弱
-        r_h_change = r_h_diff > self.threshold * self.threshold_times # 为阈值加权，因此整体权重变弱
-        r_s_change = r_s_diff > self.threshold * self.threshold_times
-        r_v_change = r_v_diff > self.threshold * 3 * self.threshold_times # V通道更敏感
-
-        ## Left ##
-        # 计算与参考颜色的差异
-        l_h_diff = abs(self.l_current_hsv[0] - self.l_reference_hsv[0])
-        l_s_diff = abs(self.l_current_hsv[1] - self.l_reference_hsv[1])
-        l_v_diff = abs(self.l_current_hsv[2] - self.l_reference_hsv[2])
-        
-        # 因环境影响，权重较弱
-        l_h_change = l_h_diff > self.threshold * self.threshold_times # 为阈值加权，因此整体权重变弱
-        l_s_change = l_s_diff > self.threshold * self.threshold_times 
-        l_v_change = l_v_diff > self.threshold * 3 * self.threshold_times # V通道更敏感
+        self.t_h.append(analysis.timestamp if analysis.timestamp is not None else time.monotonic())
+        self.r_h.append(ratio[self.proc.center_zone()])
+
+        # 检查是否有任何区域的任何通道变化明显
+        self.zone_changed = (ratio > 1).any(axis=1)
+        zone_ratio = ratio.max(axis=1)
+        self.zone_margin = float(zone_ratio.max())
+        any_changed = bool(self.zone_changed.any())
 
-        # 检查是否有任何一个通道变化明显
-        m_any_changed = m_h_change or m_s_change or m_v_change # 中间部分hsv变化
-        r_any_changed = r_h_change or r_s_change or r_v_change # 右侧部分hsv变化
-        l_any_changed = l_h_change or l_s_change or l_v_change # 左侧部分hsv变化
-        any_changed = m_any_changed or r_any_changed or l_any_changed #整体hsv变化
+        if self.background is not None and not any_changed:
+            self.background.update(current, analysis.timestamp, zone_ratio < self.adapt_margin)
 
         return any_changed
 
@@ -94,37 +245,147 @@ class ColorDetect:
         if not self.initialized:
             self._initialize()
 
-        l_current_hsv, m_current_hsv, r_current_hsv = self.proc.get_hsv_values()
+        analysis = self.proc.analyze()
+        l_current_hsv, m_current_hsv, r_current_hsv = analysis.left_avg, analysis.middle_avg, analysis.right_avg
 
-        h_homo=abs(l_current_hsv[0]-m_current_hsv[0])+abs(r_current_hsv[0]-m_current_hsv[0])
-        s_homo=abs(l_current_hsv[1]-m_current_hsv[1])+abs(r_current_hsv[1]-m_current_hsv[1])
-        v_homo=abs(l_current_hsv[2]-m_current_hsv[2])+abs(r_current_hsv[2]-m_current_hsv[2])
+        # 色相差按饱和度加权，近无色时只比较饱和度与明度
+        h_homo,s_homo,v_homo=(color_metric.hsv_distance(l_current_hsv,m_current_hsv)+
+                              color_metric.hsv_distance(r_current_hsv,m_current_hsv))
 
         homo=h_homo<self.threshold and s_homo<self.threshold and v_homo<self.threshold*2
 
         return homo
 
+# 自适应滴加：依据中间区域颜色差异逼近阈值的程度与趋势降低速度，接近终点时改为脉冲式微量滴加
+class DoseController:
+
+    def __init__(self,clock=time.time,slow_start=0.4,pulse_start=0.8,min_fraction=0.2,
+                 pulse_on=0.5,pulse_off=2.0,lookahead=2.0,steps=8,trend_window=1.5,max_boost=0.3):
+        self.clock=clock
+        self.slow_start=slow_start # 差异达到阈值的该比例时开始减速
+        self.pulse_start=pulse_start # 差异达到阈值的该比例时改为脉冲滴加
+        self.min_fraction=min_fraction # 最低速度占设定速度的比例
+        self.pulse_on=pulse_on # 每次脉冲滴加的秒数
+        self.pulse_off=pulse_off # 脉冲间歇秒数，供溶液混合显色
+        self.lookahead=lookahead # 按趋势外推的秒数
+        self.steps=steps # 速度分档数，避免频繁改速
+        self.trend_window=trend_window # 拟合趋势所用的秒数，过短时外推会放大逐帧噪声
+        self.max_boost=max_boost # 趋势外推最多增加的比值
+        self.proximity=0.0
+        self._pulse_origin=None
+        self._history=collections.deque()
+
+    def reset(self):
+        self.proximity=0.0
+        self._pulse_origin=None
+        self._history.clear()
+
+    def estimate(self,cd):
+        # 在最近trend_window秒内对中间区域差异与阈值之比做线性拟合，
+        # 取拟合的当前值与按趋势外推值中的较大者；不足半个窗口时只用最新值
+        if not cd.r_h:
+            return 0.0
+        now=cd.t_h[-1]
+        self._history.append((now,np.array(cd.r_h[-1],dtype=np.float64)))
+        while now-self._history[0][0]>self.trend_window:
+            self._history.popleft()
+        current=self._history[-1][1]
+        t=np.array([s[0] for s in self._history],dtype=np.float64)
+        if t[-1]-t[0]>=self.trend_window/2:
+            ratio=np.array([s[1] for s in self._history]).T
+            t=t-t.mean()
+            slope=(ratio-ratio.mean(axis=1,keepdims=True))@t/float((t*t).sum())
+            current=ratio.mean(axis=1)+slope*t[-1]
+            current=current+np.clip(slope*self.lookahead,0,self.max_boost)
+        return float(current.max())
+
+    def update(self,cd,rate):
+        # 返回(速度, 是否滴加)
+        self.proximity=self.estimate(cd)
+        if self.proximity<self.pulse_start:
+            self._pulse_origin=None
+            if self.proximity<self.slow_start:
+                return rate,True
+            # 线性减速并分档
+            fraction=1-(1-self.min_fraction)*(self.proximity-self.slow_start)/(self.pulse_start-self.slow_start)
+            fraction=np.ceil(fraction*self.steps)/self.steps
+            return round(rate*max(fraction,self.min_fraction),2),True
+
+        now=self.clock()
+        if self._pulse_origin is None:
+            self._pulse_origin=now
+        phase=(now-self._pulse_origin)%(self.pulse_on+self.pulse_off)
+        return round(rate*self.min_fraction,2),phase<self.pulse_on
+
+# 终点预测：颜色开始变化后对阈值裕度做增量最小二乘拟合，置信度足够时提前确认终点
+class EndpointEstimator:
+
+    def __init__(self,confidence=0.99,min_time=3.0,min_samples=10,min_fraction=0.5,sample_rate=2.0):
+        self.z=statistics.NormalDist().inv_cdf(confidence)
+        self.min_time=min_time # 至少持续变化的秒数
+        self.min_samples=min_samples
+        self.min_fraction=min_fraction # 至少经过确认窗口的该比例，短暂闪现的颜色在此之前已褪去
+        self.sample_rate=sample_rate # 每秒有效独立样本数，相邻帧噪声高度相关，不能按帧数计
+        self.reset()
+
+    def reset(self):
+        self.n=0
+        self.st=self.stt=self.sy=self.sty=self.syy=0.0
+
+    def add(self,t,margin):
+        # t为颜色开始变化后的秒数，margin为差异与阈值之比的最大值（>1即判定为变化）
+        self.n+=1
+        self.st+=t
+        self.stt+=t*t
+        self.sy+=margin
+        self.sty+=t*margin
+        self.syy+=margin*margin
+        self.t=t
+
+    def confident(self,horizon):
+        # 当前裕度与外推到确认窗口结束时的裕度，其置信下界均大于1时返回True
+        n=self.n
+        if n<self.min_samples or self.t<max(self.min_time,self.min_fraction*horizon):
+            return False
+        t_mean=self.st/n
+        sxx=self.stt-n*t_mean*t_mean
+        if sxx<=0:
+            return False
+        y_mean=self.sy/n
+        slope=(self.sty-n*t_mean*y_mean)/sxx
+        intercept=y_mean-slope*t_mean
+        sse=self.syy-intercept*self.sy-slope*self.sty
+        s=np.sqrt(max(sse,0.0)/(n-2))
+        # 残差按帧估计，置信区间按持续时间折算的有效样本数放宽
+        n_eff=min(n,max(self.t*self.sample_rate,3.0))
+        s*=np.sqrt(n/n_eff)
+
+        now_low=intercept+slope*self.t-self.z*s*np.sqrt(1/n+(self.t-t_mean)**2/sxx)
+        end_low=intercept+slope*horizon-self.z*s*np.sqrt(1/n+(horizon-t_mean)**2/sxx)
+        return now_low>1 and end_low>1
+
 # 9.22 Charlotte_liu修改
 class Timer:
 
-    def __init__(self):
+    def __init__(self,clock=time.time):
+        self.clock=clock # 离线回放时替换为模拟时钟
         self.time_dict = {'elapsed':0.0,'start':0.0,'pause':0.0}
         self.started = False
         self.paused = False
 
     def start(self):
-        self.time_dict['start']=time.time()
+        self.time_dict['start']=self.clock()
         self.started = True
 
     def update_time(self):
-        elapsed=time.time()-self.time_dict['start']
+        elapsed=self.clock()-self.time_dict['start']
         self.time_dict['elapsed']=elapsed
 
     def pause(self):
         if self.started:
-            elapsed = time.time()-self.time_dict['start']
+            elapsed = self.clock()-self.time_dict['start']
             self.time_dict['elapsed']+=elapsed
-            self.time_dict['pause']=time.time()
+            self.time_dict['pause']=self.clock()
             self.paused=True
 
     def reset(self): #
@@ -137,10 +398,39 @@ class Titration:
     def __init__(self,rate='05.00',port='COM1',cap_num=0,threshold=30,threshold_times=1.5):
         self.rate=rate
         self.port=port
+        self.pump_model='Arduino' # 泵型号，见pump_control.pump_drivers
         self.cap_num=cap_num
+        self.cap_profile=None # 摄像头采集规格，为空时使用cap_process.Cap.default_profile
         self.threshold=threshold
         self.threshold_times=threshold_times
         self.usemask=True
+        self.zone_grid=[1,3]
+        self.record_dir='runs' # 逐帧记录目录，为空则不记录
+        self.station_name='' # 所属工位名，用于区分共用记录目录中的各次滴定
+        self.v_times=3
+        self.zone_weights=None
+        self.confirm_time=15 # 颜色持续变化多少秒后判定终点
+        self.adaptive_dosing=False # 接近终点时自动减速并脉冲滴加
+        self.confirm_confidence=0 # 提前确认终点所需置信度，为0时只用固定确认窗口
+        self.confirm_min_time=3.0
+        self.color_metric='hsv' # 颜色差异：hsv（环形色相）或lab（CIE ΔE2000）
+        self.use_prediction=False # 以大模型预测的终点颜色为目标，按接近目标的进度减速和确认终点
+        self.use_indicator_defaults=False # 指示剂表命中时采用该体系推荐的color_metric与threshold
+        self.indicator=None # 指示剂表的匹配结果，见indicator_table.lookup
+        self.target_fraction=0.5 # 进度（0~1）达到该比例视为变色
+        self.sigma_threshold=None # 非空时启用自适应参考颜色，阈值为背景标准差的倍数
+        self.adapt_time=120 # 背景模型跟随光照漂移的时间常数（秒）
+        self.min_std=1.0
+        self.white_roi=None # 白色参考块[x, y, w, h]，用于补偿整体光照变化
+        self.volume_limit=None # 单次滴定体积上限（mL），达到后停止
+        self.rinse_rate='15.00'
+        self.rinse_time=60 # 润洗时长（秒）
+        self.refill_time=30 # 批量滴定时两个样品之间更换烧杯、补液的等待时间（秒）
+        self.endpoint_alert=True # 终点时弹出需确认的提示框，批量滴定时改为通知
+        self.stopped=threading.Event() # 停止时唤醒润洗等定时等待
+        self.estimator=None
+        self.dose=None
+        self.current_rate=None
         self.cd=None
         self.pump=None
         self.cap=None
@@ -150,26 +440,40 @@ class Titration:
         self.time=0
         self.mp=None
         self._titration_thread = None
+        self._preview_thread = None
         self.predict_color=None
         self.predict_hsv=None
         self.timer_normal=None
         self.timer_elapsed=None
         self.ispreview=True
+        self.autopreview=True # 停止后自动恢复预览，离线回放时关闭
+        self.clock=time.time
+        self.analysis_pool=None # 多工位共享的分析池，见analysis_process，由station_process设置
+        self.endpoint_seq=None
+        self.endpoint_time=None
+        self.endpoint_volume=None
+        self.endpoint_confirm=None # 颜色开始持续变化到确认终点的秒数
 
     def _run_con(self):
         try:
             self.mp.send('wa')
-            self.cd=ColorDetect(self.threshold,self.threshold_times)
+            threshold,metric=self.detect_params()
+            self.cd=ColorDetect(threshold,self.threshold_times,v_times=self.v_times,zone_weights=self.zone_weights,
+                                sigma_threshold=self.sigma_threshold,adapt_time=self.adapt_time,min_std=self.min_std,
+                                metric=metric)
             self.cd.mp=self.mp
 
-            self.pump=pump_control.Pump(self.port)
+            self.pump=pump_control.create_pump(self.port,self.pump_model)
             self.pump.setrate(self.rate)
 
-            self.cap=cap_process.Cap(int(self.cap_num))
+            self.cap=cap_process.Cap(int(self.cap_num),profile=self.cap_profile)
+            self.cap.mp=self.mp
             self.cd.proc=cap_process.HSVProcessor()
             self.cd.proc.mp=self.mp
             self.cd.proc.frame=self.cap.get_frame()
             self.cd.proc.usemask=self.usemask
+            self.cd.proc.zone_grid=tuple(self.zone_grid)
+            self.cd.proc.white_roi=tuple(self.white_roi) if self.white_roi else None
             self.mp.send('cs')
             self.preview()
         except Exception as e:
@@ -184,10 +488,14 @@ class Titration:
     def _run_preview(self):
         time.sleep(1)
         try:
+            seq=0
             while self.ispreview:
-                self.cd.proc.frame=self.cap.get_frame()
+                seq,ts,frame=self.cap.wait_frame(seq)
+                self.cd.proc.set_frame(frame,seq,ts)
                 frame_copy=self.cd.proc.show_frame_window()
         except Exception as e:
+            # 释放摄像头时预览线程随之退出，不作为错误记录
+            if self.ispreview:
                 self.mp.log('pe',f'{e}')
         
     def preview(self):
@@ -199,13 +507,25 @@ class Titration:
         self.ispreview=False
         self.volume=0
         self.time=0
-        self.timer_normal = Timer()
-        self.timer_elapsed = Timer()
+        self.timer_normal = Timer(self.clock)
+        self.timer_elapsed = Timer(self.clock)
+        self.dose = DoseController(self.clock) if self.adaptive_dosing else None
+        self.estimator = EndpointEstimator(self.confirm_confidence, self.confirm_min_time) if self.confirm_confidence else None
+        self.endpoint_seq = None
+        self.endpoint_time = None
+        self.endpoint_volume = None
+        self.endpoint_confirm = None
+        self.cd.target_fraction = self.target_fraction
+        self.cd.clear_history()
+        self.cd.set_target(self.predict_hsv if self.use_prediction else None)
+        start_time = self.clock()
         pump_stopped = False
+        dose_paused = False # 脉冲滴加的间歇期
         last_elapsed = 0
         pump_lock = threading.Lock()
+        self.current_rate = float(self.rate)
 
-        def safe_pump_operation(operation):
+        def safe_pump_operation(operation, rate=None):
             with pump_lock:
                 if operation == 'start':
                     self.pump.start()
@@ -213,46 +533,89 @@ class Titration:
                 elif operation == 'stop':
                     self.pump.stop()
                     return True
+                elif operation == 'setrate':
+                    self.pump.setrate(rate)
+                    return True
             return False
 
+        def close_segment():
+            # 结束当前泵运行段的计时，体积与时间由泵命令层计量
+            if self.timer_normal.started:
+                self.timer_normal.pause()
+                self.timer_normal.reset()
+
+        self.pump.meter.reset()
         if self.running:
             if safe_pump_operation('start'):
                 self.timer_normal.start()
 
+        recorder = None
+        if self.record_dir:
+            try:
+                recorder = record_process.RunRecorder(self.record_dir, int(np.prod(self.zone_grid)),
+                    meta={'station': self.station_name, 'rate': self.rate, 'threshold': self.cd.threshold,
+                          'color_metric': self.cd.metric, 'threshold_times': self.threshold_times,
+                          'zone_grid': self.zone_grid, 'usemask': self.usemask},
+                    station=self.station_name)
+                recorder.mp = self.mp
+            except Exception as e:
+                self.mp.log('we',f'{e}')
+
+        seq = 0
         while self.running:
             try:
-                self.cd.proc.frame = self.cap.get_frame()
+                # 仅处理新帧，跳过已分析过的帧
+                seq, ts, frame = self.cap.wait_frame(seq)
+                self.cd.proc.set_frame(frame, seq, ts)
+                if self.analysis_pool and self.cd.initialized:
+                    # 多工位时在共享线程池或工作进程中完成颜色空间转换和区域统计
+                    self.analysis_pool.analyze(self.cd.proc)
                 is_color_changed = self.cd.is_color_changed()
-                # is_color_homo = self.cd.is_color_homo()
+                is_color_homo = self.cd.is_color_homo()
                 frame_copy=self.cd.proc.show_frame_window()
+                confirmed = False
+                limited = False
+                self.volume, self.time = self.pump.dispensed()
 
                 if is_color_changed:
-                    if self.timer_normal.started:
-                        if safe_pump_operation('stop'):
+                    if self.timer_normal.started or dose_paused:
+                        if not pump_stopped and safe_pump_operation('stop'):
                             pump_stopped = True
 
-                        self.timer_normal.pause()
-                        time_elapsed = self.timer_normal.time_dict['elapsed']
-                        self.time += time_elapsed
-                        volume_increment = float(self.rate) / 60 * time_elapsed
-                        self.volume += volume_increment
+                        close_segment()
+                        dose_paused = False
                         self.endpoint = True
                         self.mp.log('et')
-                        self.timer_normal.reset()
 
                     if not self.timer_elapsed.started or self.timer_elapsed.paused:
                         self.timer_elapsed.start()
+                        if self.estimator:
+                            self.estimator.reset()
 
                     self.timer_elapsed.update_time()
-
-                    if self.timer_elapsed.time_dict['elapsed'] >= 15 and self.running:
-                        self.mp.alert('ep',f'{self.volume:.2f} mL')
+                    elapsed = self.timer_elapsed.time_dict['elapsed']
+                    predicted = False
+                    if self.estimator:
+                        self.estimator.add(elapsed, self.cd.zone_margin)
+                        predicted = self.estimator.confident(self.confirm_time)
+
+                    if (elapsed >= self.confirm_time or predicted) and self.running:
+                        self.mp.log('ec',f'{elapsed:.2f} s {"PREDICTED" if predicted and elapsed < self.confirm_time else "WINDOW"}')
+                        self.endpoint_seq=seq
+                        self.endpoint_time=self.clock()-start_time
+                        self.endpoint_volume=self.volume
+                        self.endpoint_confirm=elapsed
+                        if self.endpoint_alert:
+                            self.mp.alert('ep',f'{self.volume:.2f} mL')
+                        else:
+                            self.mp.box('ep',f'{self.volume:.2f} mL')
                         self.running=False
                         self.mp.log('fl',self.cd.l_current_hsv)
                         self.mp.log('fm',self.cd.m_current_hsv)
                         self.mp.log('fr',self.cd.r_current_hsv)
+                        self.mp.log('fh',is_color_homo)
                         self.timer_elapsed.reset()
-                        self.stop()
+                        confirmed = True
 
                 else:
                     if self.timer_elapsed.started and not self.timer_elapsed.paused:
@@ -261,18 +624,63 @@ class Titration:
                         self.endpoint = False
                         self.timer_elapsed.reset()
 
-                    if pump_stopped:
-                        if safe_pump_operation('start'):
-                            pump_stopped = False 
-
-                    if not self.timer_normal.started or self.timer_normal.paused:
-                        self.timer_normal.start()
+                    # 自适应滴加：根据颜色差异趋势决定速度及是否处于脉冲间歇
+                    dose_rate, dose_on = float(self.rate), True
+                    if self.dose:
+                        dose_rate, dose_on = self.dose.update(self.cd, float(self.rate))
+
+                    if dose_rate != self.current_rate:
+                        close_segment()
+                        if safe_pump_operation('setrate', f'{dose_rate:05.2f}'):
+                            self.current_rate = dose_rate
+
+                    if not dose_on:
+                        if not pump_stopped:
+                            close_segment()
+                            if safe_pump_operation('stop'):
+                                pump_stopped = True
+                                dose_paused = True
+                    else:
+                        if pump_stopped:
+                            if safe_pump_operation('start'):
+                                pump_stopped = False
+                                dose_paused = False
+
+                        if not self.timer_normal.started or self.timer_normal.paused:
+                            self.timer_normal.start()
+
+                if self.volume_limit and self.volume >= float(self.volume_limit) and not confirmed:
+                    self.mp.log('vl',f'{self.volume:.2f} mL')
+                    self.running=False
+                    limited = True
+
+                if recorder:
+                    recorder.append(seq, ts, self.cd.proc.analysis.zone_mean, self.cd.zone_diff,
+                                    is_color_changed, is_color_homo, self.endpoint, confirmed,
+                                    not pump_stopped, self.volume)
+
+                if confirmed or limited:
+                    self.stop()
 
             except Exception as e:
+                if not self.running:
+                    break # 已被释放，摄像头关闭导致的中断不再报错
+                if str(e) == 'CapEndOfStream':
+                    # 回放到录像结尾是正常结束：停泵退出，不释放硬件也不报滴定错误
+                    close_segment()
+                    safe_pump_operation('stop')
+                    self.running = False
+                    self.mp.log('eo', f'{self.volume:.2f} mL')
+                    break
                 self.release()
                 self.running=False
                 self.mp.send('te',f'{e}')
 
+        if recorder:
+            recorder.close()
+        if hasattr(self.cap,'frame_stats'):
+            self.mp.log('cj',f'{self.cap.frame_stats()}')
+
     def run(self):
         if not self.running:
             self.running = True
@@ -284,6 +692,7 @@ class Titration:
     def stop(self):
         try:
             self.mp.log('ms')
+            self.stopped.set()
             self.pump.stop()
             self.running=False
             self.endpoint=False
@@ -293,18 +702,18 @@ class Titration:
             self.timer_normal.reset()
             self.timer_elapsed.reset()
             self.ispreview=True
-            self.preview()
+            if self.autopreview:
+                self.preview()
         except Exception as e:
             self.mp.send('se',f'{e}')
 
     def _run_rinse(self):
         try:
-            self.pump.setrate('15.00')
+            self.stopped.clear()
+            self.pump.setrate(self.rinse_rate)
             self.pump.start()
-            time1=time.time()
-            time2=time1
-            while time2-time1<60:
-                time2=time.time()
+            # 定时等待，停止时提前唤醒
+            self.stopped.wait(float(self.rinse_time))
             self.pump.setrate(self.rate)
             self.pump.stop()
         except Exception as e:
@@ -326,27 +735,66 @@ class Titration:
             self.volume=0
             self.time=0
             self.pump.release()
-            self.ispreview=True
             self.timer_normal.reset()
             self.timer_elapsed.reset()
         except Exception as e:
             self.mp.send('le',f'{e}')
+        finally:
+            # 泵释放失败时同样关闭摄像头，重新连接时才能再次打开
+            self.close_cap()
+            self.mp.flush()
+
+    def close_cap(self):
+        # 停止预览，关闭摄像头并等待采集、预览及滴定线程退出
+        self.ispreview=False
+        try:
+            if self.cap:
+                self.cap.close_cap()
+            for thread in (self._preview_thread, self._titration_thread):
+                if thread and thread is not threading.current_thread():
+                    thread.join(timeout=1)
+        except Exception as e:
+            self.mp.send('le',f'{e}')
+        finally:
+            self.ispreview=True
 
     def llm_predict(self,exptype):
         try:
             self.mp.log('pr')
-            predict_color=ds_connect.llm_get_color(exptype)
+            # 先清除上一个样品的预测，查表与大模型都失败时按差异模式判定，而不是驶向上一个样品的终点颜色
+            self.indicator=None
+            self.predict_color=None
+            self.predict_hsv=None
+            # 常见指示剂体系直接查表，离线可用；查不到时再请求大模型
+            self.indicator=indicator_table.lookup(exptype)
+            if self.indicator:
+                self.mp.log('it',f"{self.indicator['indicator']} {self.indicator['transition']} {self.indicator['endpoint']}")
+                predict_color=self.indicator['endpoint']
+            # 推荐参数只用于本次预测对应的滴定，查不到时恢复配置的阈值与判定方式
+            self.apply_detect_params()
+            if not self.indicator:
+                predict_color=ds_connect.llm_get_color(exptype)
+            predict_hsv=color_metric.hex_to_hsv(predict_color)
             self.predict_color=predict_color
-            def hex_to_hsv(hex_color):
-                hex_color = hex_color.lstrip('#')
-                r = int(hex_color[0:2], 16)
-                g = int(hex_color[2:4], 16)
-                b = int(hex_color[4:6], 16)
-                bgr_array = np.uint8([[[b, g, r]]])
-                hsv_array = cv2.cvtColor(bgr_array, cv2.COLOR_BGR2HSV)
-                h, s, v = hsv_array[0][0]
-                return [h, s, v]
-            predict_hsv=hex_to_hsv(predict_color)
             self.predict_hsv=predict_hsv
         except Exception as e:
-            self.mp.send('me',f'{e}')
\ No newline at end of file
+            self.mp.send('me',f'{e}')
+
+    def detect_params(self):
+        # 本次滴定的阈值与判定方式：启用指示剂推荐参数且查表命中时用推荐值，否则用配置值；配置值本身不被改写
+        if self.use_indicator_defaults and self.indicator:
+            return self.indicator['threshold'],self.indicator['color_metric']
+        return self.threshold,self.color_metric
+
+    def apply_detect_params(self):
+        # 参考颜色尚未取得时立即生效，否则在下次cd.reset（批量滴定的每个样品）或重新连接时生效
+        threshold,metric=self.detect_params()
+        if self.cd is not None and not self.cd.initialized:
+            self.cd.metric=metric
+            self.cd.threshold=threshold
+        if self.use_indicator_defaults and self.indicator:
+            self.mp.log('id',f'{metric} {threshold}')
+
+    def llm_predict_async(self,exptype):
+        # 在后台线程中预测，网页请求立即返回，结果通过状态推送显示
+        return ds_connect.submit(self.llm_predict,exptype)
\ No newline at end of file
@@ -0,0 +1,136 @@
+# 化学笺集自动化滴定项目的一部分，用于在录像上并行搜索终点判定参数
+# 作者：李峙德，刘一弘
+# 邮箱：contact@chemview.net
+# 最后更新：2026-10-18
+import os
+import csv
+import json
+import hashlib
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import replay_process
+
+# 区域统计方法变化时递增，使旧缓存失效
+_CACHE_VERSION=3
+
+# 工作进程内共享的归约数据，由进程池初始化时传入一次
+_recordings=None
+_reduced=None
+
+def _cache_path(cache_dir, rec, zone_grid):
+    # 以文件及取样参数生成缓存键，录像变动后自动失效
+    stat=os.stat(rec['source']) if os.path.exists(rec['source']) else None
+    key=json.dumps([_CACHE_VERSION, os.path.abspath(rec['source']), stat and stat.st_mtime, stat and stat.st_size, rec['roi'],
+                    rec.get('usemask', False), rec.get('hsv_lower'), rec.get('hsv_upper'),
+                    list(zone_grid), rec.get('fps')])
+    return os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest()+'.npz')
+
+def _reduce(args):
+    rec, zone_grid, cache_dir=args
+    path=_cache_path(cache_dir, rec, zone_grid)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}
+    reduced=replay_process.reduce_source(rec['source'], rec['roi'], rec.get('usemask', False),
+                                         rec.get('hsv_lower'), rec.get('hsv_upper'), zone_grid, rec.get('fps'))
+    np.savez_compressed(path, **reduced)
+    return reduced
+
+def _init_worker(recordings, reduced):
+    global _recordings, _reduced
+    _recordings=recordings
+    _reduced=reduced
+
+def _evaluate(point):
+    # 在全部录像上评估一组参数，返回终点误差与检测延迟
+    time_errors=[]
+    volume_errors=[]
+    latencies=[]
+    missed=0
+    for rec, reduced in zip(_recordings, _reduced):
+        result=replay_process.replay_zones(reduced, rec.get('rate', '06.00'), point['threshold'],
+                                           point['threshold_times'], point['v_times'], point['confirm_time'],
+                                           point['zone_weights'], rec.get('usemask', False), point['confidence'])
+        if not result['endpoint']:
+            missed+=1
+            continue
+        # 判定时间减去确认用时即为颜色开始持续变化的时刻
+        onset=result['time']-result['confirm']
+        time_errors.append(abs(onset-rec['endpoint_time']))
+        latencies.append(result['time']-rec['endpoint_time'])
+        if rec.get('endpoint_volume') is not None:
+            volume_errors.append(abs(result['volume']-rec['endpoint_volume']))
+
+    def mean(values):
+        return float(np.mean(values)) if values else float('nan')
+
+    return {**point,
+            'detected': len(_recordings)-missed,
+            'missed': missed,
+            'time_error': mean(time_errors),
+            'volume_error': mean(volume_errors),
+            'latency': mean(latencies)}
+
+def _rank_key(row):
+    # 漏检最少优先，其次终点误差，再次检测延迟
+    error=row['volume_error'] if not np.isnan(row['volume_error']) else row['time_error']
+    return (row['missed'], np.nan_to_num(error, nan=np.inf), np.nan_to_num(row['latency'], nan=np.inf))
+
+def tune(recordings, thresholds, threshold_times, v_times, confirm_times, zone_weights=(None,),
+         zone_grid=(1, 3), cache_dir='.tune_cache', workers=None, confidences=(0,)):
+    # 每个录像只解码归约一次，再在进程池中评估全部参数组合，返回按误差排序的结果
+    os.makedirs(cache_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        reduced=list(pool.map(_reduce, [(rec, zone_grid, cache_dir) for rec in recordings]))
+
+    points=[{'threshold': a, 'threshold_times': b, 'v_times': c, 'confirm_time': d, 'zone_weights': e, 'confidence': f}
+            for a, b, c, d, e, f in itertools.product(thresholds, threshold_times, v_times, confirm_times,
+                                                      zone_weights, confidences)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(recordings, reduced)) as pool:
+        rows=list(pool.map(_evaluate, points, chunksize=max(1, len(points)//(4*(workers or os.cpu_count() or 1)))))
+
+    return sorted(rows, key=_rank_key)
+
+def _parse_weights(text):
+    return [float(v) for v in text.split(',')]
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='在录像上并行搜索终点判定参数')
+    parser.add_argument('manifest', help='录像清单JSON：[{"source", "roi", "endpoint_time", "endpoint_volume", "rate", ...}]')
+    parser.add_argument('--threshold', type=float, nargs='+', default=[13])
+    parser.add_argument('--threshold-times', type=float, nargs='+', default=[1])
+    parser.add_argument('--v-times', type=float, nargs='+', default=[3])
+    parser.add_argument('--confirm-time', type=float, nargs='+', default=[15])
+    parser.add_argument('--confidence', type=float, nargs='+', default=[0], help='提前确认终点的置信度，0为只用固定窗口')
+    parser.add_argument('--zone-weights', type=_parse_weights, nargs='+', default=[None],
+                        help='各区域阈值权重，逗号分隔，如 1.5,1,1.5')
+    parser.add_argument('--zone-grid', type=int, nargs=2, default=[1, 3], metavar=('ROWS', 'COLS'))
+    parser.add_argument('--cache-dir', default='.tune_cache')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', help='保存完整结果的CSV文件')
+    args=parser.parse_args()
+
+    with open(args.manifest, 'r') as f:
+        recordings=json.load(f)
+
+    rows=tune(recordings, args.threshold, args.threshold_times, args.v_times, args.confirm_time,
+              args.zone_weights, args.zone_grid, args.cache_dir, args.workers, args.confidence)
+
+    print(f"{'#':>3} {'threshold':>9} {'times':>6} {'v':>5} {'confirm':>7} {'conf':>5} {'weights':>16} "
+          f"{'hit':>5} {'t_err(s)':>9} {'v_err(mL)':>9} {'latency(s)':>10}")
+    for i, row in enumerate(rows[:args.top], 1):
+        weights=','.join(f'{w:g}' for w in row['zone_weights']) if row['zone_weights'] else '-'
+        print(f"{i:>3} {row['threshold']:>9g} {row['threshold_times']:>6g} {row['v_times']:>5g} "
+              f"{row['confirm_time']:>7g} {row['confidence']:>5g} {weights:>16} {row['detected']:>2}/{len(recordings):<2} "
+              f"{row['time_error']:>9.2f} {row['volume_error']:>9.3f} {row['latency']:>10.2f}")
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            writer=csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)